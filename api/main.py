@@ -67,9 +67,12 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     """Login to get access token"""
     # In a real application, you would verify credentials against a database
     # For now, we'll use a simple check against environment variables
-    if form_data.username != "admin" or not security_manager.verify_password(
+    admin_password = await db_manager.aget_cache("admin_password")
+    # PBKDF2 is deliberately slow; derive the key off the event loop
+    if form_data.username != "admin" or not await asyncio.to_thread(
+        security_manager.verify_password,
         form_data.password,
-        db_manager.get_cache("admin_password")
+        admin_password
     ):
         raise HTTPException(
             status_code=401,
@@ -92,7 +95,7 @@ async def list_sessions(_: dict = Depends(get_current_user)):
     """List all sessions"""
     try:
         sessions = await session_manager.list_sessions()
-        return [UserSession(**session) for session in sessions]
+        return [UserSession(**session._asdict()) for session in sessions]
     except Exception as e:
         logger.error(f"Failed to list sessions: {e}")
         raise HTTPException(
@@ -167,7 +170,7 @@ async def websocket_endpoint(websocket: WebSocket):
             await websocket.send_json({
                 "type": "status_update",
                 "data": {
-                    "sessions": sessions,
+                    "sessions": [session._asdict() for session in sessions],
                     "timestamp": datetime.utcnow().isoformat()
                 }
             })
@@ -128,7 +128,7 @@ async def handle_phone_step(event, bot_instance, auth_state):
             return
         
         # Get user's API credentials from whitelist
-        user_data = whitelist_manager.get_user_data(user_id)
+        user_data = await whitelist_manager.aget_user_data(user_id)
         if not user_data:
             logger.error(f"User {user_id} not found in whitelist")
             await event.respond("❌ You are not authorized to use this bot. Please contact the administrator.")
@@ -200,7 +200,7 @@ async def handle_code_step(event, bot_instance, auth_state):
             return
         
         # Get user's API credentials from whitelist
-        user_data = whitelist_manager.get_user_data(user_id)
+        user_data = await whitelist_manager.aget_user_data(user_id)
         if not user_data:
             logger.error(f"User {user_id} not found in whitelist")
             await event.respond("❌ Authorization failed. Please contact the administrator.")
@@ -211,7 +211,7 @@ async def handle_code_step(event, bot_instance, auth_state):
         logger.info(f"Creating new UserInstance for user_id={user_id}, phone={auth_state['phone']}")
         instance = UserInstance(
             user_id=user_id,
-            api_hash=user_data['api_hash'],
+            api_hash=user_data.api_hash,
             phone=auth_state['phone'],
             session_id=auth_state['session_id']  # Use session_id from auth_state instead of user_data
         )
@@ -277,8 +277,11 @@ class ControlBot:
             # Set bot instance on client
             self.client._bot_instance = self
             
-            # Start the client
-            await self.client.start(bot_token=self.bot_token)
+            # Start the client, loading the whitelist while it connects
+            await asyncio.gather(
+                self.client.start(bot_token=self.bot_token),
+                whitelist_manager.initialize()
+            )
             
             # Register message handler
             self.client.add_event_handler(
@@ -407,6 +410,7 @@ class ControlBot:
             logger.info("\nSaving final instance states...")
             sys.stdout.flush()
             self._save_instances()
+            await session_manager.flush()
             logger.info("Instance states saved successfully")
             sys.stdout.flush()
             
@@ -192,8 +192,8 @@ async def start_authentication(event, bot_instance):
             return
         
         # Check if user is registered
-        user_data = whitelist_manager.get_user_data(user_id)
-        if not user_data.get('registered'):
+        user_data = await whitelist_manager.aget_user_data(user_id)
+        if not user_data.registered:
             logger.warning(f"User {user_id} is whitelisted but not registered")
             await event.respond(
                 "⚠️ Your account is whitelisted but not fully registered.\n"
@@ -1,13 +1,12 @@
 import asyncio
 import traceback
 from datetime import datetime, timedelta
+from typing import Optional
 from telethon.tl.custom import Button
 from utils.logger import logger
 from core.session import session_manager
 from .menu import send_menu_message  # Import the send_menu_message function
-from telethon import TelegramClient
-from telethon.sessions import StringSession
-from utils.security import security_manager  # Fix import path
+from userbot.client import acquire_client, drop_client
 from utils.error_handler import error_handler
 
 MAX_RUNTIME = timedelta(hours=3)  # Maximum 3 hours runtime
@@ -32,8 +31,8 @@ def log_function_entry_exit(func):
     return wrapper
 
 @error_handler
-async def run_autoforward_task(instance, client):
-    """Run the auto forwarding task"""
+async def run_autoforward_task(instance, client, session_id: Optional[str] = None):
+    """Run the auto forwarding task; a pooled client's session_id is released when it ends"""
     config = instance.autoforward_config
     status = instance.autoforward_status
     
@@ -201,6 +200,9 @@ async def run_autoforward_task(instance, client):
             'stop_reason': 'task_error',
             'stop_time': datetime.utcnow().isoformat()
         })
+    finally:
+        if session_id is not None:
+            await drop_client(session_id, client)
 
 @log_function_entry_exit
 async def get_messages_to_forward(client, source_message):
@@ -290,6 +292,7 @@ async def start_autoforward(event, instance):
     user_id = instance.user_id
     logger.info(f"Starting autoforward for user {user_id}")
     
+    client = None  # Pooled; released when the handler is done with it
     try:
         # Load user's session using phone number
         session_data = session_manager.load_session(instance.phone)
@@ -304,16 +307,13 @@ async def start_autoforward(event, instance):
             
         # Create client from session data
         try:
-            session_string = security_manager.decrypt_message(session_data['session'])
-            client = TelegramClient(
-                StringSession(session_string),
+            session_string = session_manager.get_session_string(session_data)
+            client = await acquire_client(
+                session_data['session_id'],
+                session_string,
                 session_data['api_id'],
-                session_data['api_hash'],
-                device_model="ArkanisUserBot",
-                system_version="1.0",
-                app_version="1.0"
+                session_data['api_hash']
             )
-            await client.connect()
             if not await client.is_user_authorized():
                 logger.error(f"Client not authorized for user {user_id}")
                 await send_menu_message(
@@ -360,7 +360,10 @@ async def start_autoforward(event, instance):
         
         # Create and start the task
         logger.debug(f"Creating autoforward task for user {user_id}")
-        instance.autoforward_task = asyncio.create_task(run_autoforward_task(instance, client))
+        instance.autoforward_task = asyncio.create_task(
+            run_autoforward_task(instance, client, session_data['session_id'])
+        )
+        client = None  # The task releases it when it ends
         instance.autoforward_status['task'] = instance.autoforward_task
         logger.debug(f"Task created successfully for user {user_id}")
         
@@ -403,6 +406,9 @@ async def start_autoforward(event, instance):
             buttons=[[Button.inline("🔙 Back", "autoforward_menu")]]
         )
         return False
+    finally:
+        if client is not None:
+            await drop_client(session_data['session_id'], client)
 
 @log_function_entry_exit
 async def start_test_forward(event, instance, use_custom_delay: bool = False):
@@ -410,6 +416,7 @@ async def start_test_forward(event, instance, use_custom_delay: bool = False):
     user_id = instance.user_id
     logger.info(f"Starting test forward for user {user_id}")
     
+    client = None  # Pooled; released when the handler is done with it
     try:
         # Load user's session using phone number
         session_data = session_manager.load_session(instance.phone)  # This is not async
@@ -424,16 +431,13 @@ async def start_test_forward(event, instance, use_custom_delay: bool = False):
             
         # Create client from session data
         try:
-            session_string = security_manager.decrypt_message(session_data['session'])
-            client = TelegramClient(
-                StringSession(session_string),
+            session_string = session_manager.get_session_string(session_data)
+            client = await acquire_client(
+                session_data['session_id'],
+                session_string,
                 session_data['api_id'],
-                session_data['api_hash'],
-                device_model="ArkanisUserBot",
-                system_version="1.0",
-                app_version="1.0"
+                session_data['api_hash']
             )
-            await client.connect()
             if not await client.is_user_authorized():
                 logger.error(f"Client not authorized for user {user_id}")
                 await send_menu_message(
@@ -587,6 +591,9 @@ async def start_test_forward(event, instance, use_custom_delay: bool = False):
             buttons=[[Button.inline("🔙 Back", "autoforward_menu")]]
         )
         return False
+    finally:
+        if client is not None:
+            await drop_client(session_data['session_id'], client)
 
 @error_handler
 async def stop_autoforward(event, instance):
@@ -685,6 +692,7 @@ async def handle_bypass_groups_menu(event, instance):
     user_id = instance.user_id
     logger.info(f"Showing bypass groups menu for user {user_id}")
     
+    client = None  # Pooled; released when the handler is done with it
     try:
         # Load user's session
         session_data = session_manager.load_session(instance.phone)
@@ -698,16 +706,13 @@ async def handle_bypass_groups_menu(event, instance):
             
         # Create client
         try:
-            session_string = security_manager.decrypt_message(session_data['session'])
-            client = TelegramClient(
-                StringSession(session_string),
+            session_string = session_manager.get_session_string(session_data)
+            client = await acquire_client(
+                session_data['session_id'],
+                session_string,
                 session_data['api_id'],
-                session_data['api_hash'],
-                device_model="ArkanisUserBot",
-                system_version="1.0",
-                app_version="1.0"
+                session_data['api_hash']
             )
-            await client.connect()
             if not await client.is_user_authorized():
                 await send_menu_message(
                     event,
@@ -760,6 +765,9 @@ async def handle_bypass_groups_menu(event, instance):
             buttons=[[Button.inline("🔙 Back", "autoforward_menu")]]
         )
         return False
+    finally:
+        if client is not None:
+            await drop_client(session_data['session_id'], client)
 
 @error_handler
 async def handle_bypass_add_groups(event, instance):
@@ -767,6 +775,7 @@ async def handle_bypass_add_groups(event, instance):
     user_id = instance.user_id
     logger.info(f"Showing add bypass groups menu for user {user_id}")
     
+    client = None  # Pooled; released when the handler is done with it
     try:
         # Load user's session and create client
         session_data = session_manager.load_session(instance.phone)
@@ -778,13 +787,13 @@ async def handle_bypass_add_groups(event, instance):
             )
             return False
             
-        session_string = security_manager.decrypt_message(session_data['session'])
-        client = TelegramClient(
-            StringSession(session_string),
+        session_string = session_manager.get_session_string(session_data)
+        client = await acquire_client(
+            session_data['session_id'],
+            session_string,
             session_data['api_id'],
             session_data['api_hash']
         )
-        await client.connect()
         
         # Get all groups and current bypass groups
         all_groups = await get_all_user_groups(client)
@@ -816,6 +825,9 @@ async def handle_bypass_add_groups(event, instance):
             buttons=[[Button.inline("🔙 Back", "bypass_groups_menu")]]
         )
         return False
+    finally:
+        if client is not None:
+            await drop_client(session_data['session_id'], client)
 
 @error_handler
 async def handle_bypass_remove_groups(event, instance):
@@ -823,6 +835,7 @@ async def handle_bypass_remove_groups(event, instance):
     user_id = instance.user_id
     logger.info(f"Showing remove bypass groups menu for user {user_id}")
     
+    client = None  # Pooled; released when the handler is done with it
     try:
         # Load user's session and create client
         session_data = session_manager.load_session(instance.phone)
@@ -834,13 +847,13 @@ async def handle_bypass_remove_groups(event, instance):
             )
             return False
             
-        session_string = security_manager.decrypt_message(session_data['session'])
-        client = TelegramClient(
-            StringSession(session_string),
+        session_string = session_manager.get_session_string(session_data)
+        client = await acquire_client(
+            session_data['session_id'],
+            session_string,
             session_data['api_id'],
             session_data['api_hash']
         )
-        await client.connect()
         
         # Get all groups and current bypass groups
         all_groups = await get_all_user_groups(client)
@@ -872,6 +885,9 @@ async def handle_bypass_remove_groups(event, instance):
             buttons=[[Button.inline("🔙 Back", "bypass_groups_menu")]]
         )
         return False
+    finally:
+        if client is not None:
+            await drop_client(session_data['session_id'], client)
 
 @error_handler
 async def handle_bypass_group_action(event, instance, action: str, group_id: int):
@@ -1,12 +1,10 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from utils.logger import logger
-from telethon import TelegramClient
-from telethon.sessions import StringSession
 import os
 import asyncio
 from core.session import session_manager
-from utils.security import security_manager
+from userbot.client import acquire_client, drop_client
 
 class UserInstance:
     """Represents a user's personal ControlBot instance"""
@@ -58,26 +56,21 @@ class UserInstance:
                 # Try to load session from session manager using phone number
                 session_data = session_manager.load_session(self.phone)
                 if session_data:
-                    # Decrypt session string and create client with StringSession
-                    session_string = security_manager.decrypt_message(session_data['session'])
-                    self.client = TelegramClient(
-                        StringSession(session_string),
-                        api_id,
-                        self.api_hash,
-                        device_model="ArkanisUserBot",
-                        system_version="1.0",
-                        app_version="1.0"
-                    )
+                    # Decrypt session string and take the session's pooled, connected client
+                    session_string = session_manager.get_session_string(session_data)
                     # Store the session ID from the loaded data
                     self.session_id = session_data['session_id']
+                    self.client = await acquire_client(
+                        self.session_id,
+                        session_string,
+                        api_id,
+                        self.api_hash
+                    )
                     logger.info(f"Created client from stored session for user {self.user_id}")
                 else:
                     logger.warning(f"No session data found for phone {self.phone}")
                     return False
                 
-                # Connect the client
-                await self.client.connect()
-                
                 # Verify the connection
                 if await self.client.is_user_authorized():
                     self.authenticated = True
@@ -94,7 +87,7 @@ class UserInstance:
                 
                 # Update session last used timestamp
                 if session_data:
-                    session_data['last_used'] = datetime.utcnow().isoformat()
+                    session_data['last_used'] = datetime.now(timezone.utc).isoformat()
                     session_manager.save_session(self.session_id, session_data)
                 
                 return True
@@ -123,13 +116,13 @@ class UserInstance:
         self.last_activity = datetime.utcnow()
     
     async def disconnect_client(self):
-        """Disconnect the Telethon client"""
+        """Release the Telethon client; it disconnects once no other holder uses it"""
         if self.client:
             if self._cleanup_task:
                 self._cleanup_task.cancel()
                 self._cleanup_task = None
-            await self.client.disconnect()
-            self.client = None
+            client, self.client = self.client, None
+            await drop_client(self.session_id, client)
             logger.info(f"Telethon client disconnected for user {self.user_id}")
     
     def to_dict(self) -> dict:
@@ -1,8 +1,9 @@
 import os
 import asyncio
 import sys
-from typing import Dict, Optional
+from typing import Dict, Iterable, Optional, Tuple
 from datetime import datetime
+from enum import Enum, auto
 import json
 from dotenv import load_dotenv
 from utils.logger import logger
@@ -11,19 +12,106 @@ from utils.security import security_manager
 from .session import session_manager
 import time
 import subprocess
+import traceback
 from utils.whitelist import whitelist_manager
 import signal
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Most buffers a single writev() accepts (Linux: 1024); larger calls fail with EINVAL
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = -1
+if IOV_MAX <= 0:
+    IOV_MAX = 1024
+
+class RegistrationStep(Enum):
+    """Steps of the admin-driven user registration exchange"""
+    SEND_CODE = auto()  # Request a (new) verification code
+    AWAIT_CODE = auto()  # Wait for the operator to enter the code
+    DONE = auto()  # Registration completed
+
 class MainBotFoundation:
+    # Registration limits
+    MAX_CODE_REQUESTS = 3
+    MAX_CODE_ATTEMPTS = 3
+    CODE_TTL = 120  # Telegram login codes expire after ~2 minutes
+    
+    # Static menu options
+    _MAIN_MENU = (
+        "1. Configuration",
+        "2. User Settings",
+        "3. Database Settings",
+        "4. Sessions",
+        "5. ControlBot Settings",
+        "6. Shutdown",
+        "\n0. Exit"
+    )
+    _CONFIG_MENU = (
+        "1. View Current Configuration",
+        "2. Edit API Credentials",
+        "3. Edit Rate Limits",
+        "4. Edit System Parameters",
+        "\n0. Back to Main Menu"
+    )
+    _USER_MENU = (
+        "1. View Whitelisted Users",
+        "2. Add User to Whitelist",
+        "3. Remove User from Whitelist",
+        "4. Register Whitelisted User",
+        "\n0. Back to Main Menu"
+    )
+    _CONTROLBOT_MENU = (
+        "1. Start ControlBot",
+        "2. Stop ControlBot",
+        "3. View Bot Status",
+        "4. Edit Bot Settings",
+        "5. View Command Permissions",
+        "6. Edit Command Permissions",
+        "\n0. Back to Main Menu"
+    )
+    _DATABASE_MENU = (
+        "\nDatabase Settings:",
+        "1. View Database Status",
+        "2. Test Connections",
+        "3. Backup Database",
+        "4. Clear Cache",
+        "\n0. Back to Main Menu"
+    )
+    _SESSIONS_MENU = (
+        "\nSessions Management:",
+        "1. View Active Sessions",
+        "2. View Session Logs",
+        "3. Terminate Session",
+        "4. Export Session Data",
+        "\n0. Back to Main Menu"
+    )
+    
     def __init__(self):
-        self.running = True
+        self._shutdown_event = asyncio.Event()
+        self._stdin_buffer = b''
         self.current_menu = "main"
         self.menu_stack = []
         self.controlbot_process = None
         
+        # ControlBot entry point, started in a separate process
+        self.bot_script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'run_bot.py')
+        if not os.path.exists(self.bot_script):
+            raise FileNotFoundError(f"ControlBot script not found at {self.bot_script}")
+        
+        # Short-lived cache of whitelisted users for menu rendering: (timestamp, users)
+        self._whitelist_cache = (0.0, None)
+        self._shutdown_task: Optional[asyncio.Task] = None
+        self._monitor_task: Optional[asyncio.Task] = None
+        
+        # Cached ControlBot liveness for menu rendering: (timestamp, running)
+        self._status_cache = (0.0, False)
+        
+        # Pre-rendered static menu text: title -> (header, options block)
+        self._menu_cache: Dict[str, Tuple[str, str]] = {}
+        
         # Load configuration
         self.config = self._load_config()
     
@@ -37,6 +125,36 @@ class MainBotFoundation:
             'max_sessions': int(os.getenv('MAX_CONCURRENT_SESSIONS', '10'))
         }
     
+    def _get_users(self) -> dict:
+        """Get whitelisted users, reusing the last result for a few seconds"""
+        now = time.monotonic()
+        ts, users = self._whitelist_cache
+        if users is not None and now - ts < 5.0:
+            return users
+        users = whitelist_manager.get_all_users()
+        self._whitelist_cache = (now, users)
+        return users
+    
+    def _invalidate_users(self):
+        """Drop the cached whitelist so the next render reloads it"""
+        self._whitelist_cache = (0.0, None)
+    
+    def _is_running(self) -> bool:
+        """Check whether the ControlBot process is alive, polling at most every 500ms"""
+        if self.controlbot_process is None:
+            return False
+        now = time.monotonic()
+        ts, running = self._status_cache
+        if now - ts < 0.5:
+            return running
+        running = self.controlbot_process.poll() is None
+        self._status_cache = (now, running)
+        return running
+    
+    def _invalidate_status(self):
+        """Force the next _is_running call to poll the process"""
+        self._status_cache = (0.0, False)
+    
     def _clear_screen(self):
         """Clear the terminal screen"""
         # Ensure all output is flushed
@@ -50,51 +168,104 @@ class MainBotFoundation:
             # More thorough clearing for Unix-like systems
             os.system('clear && printf "\033c\033[3J"')
         
-        # Ensure terminal is ready
-        sys.stdout.flush()
-        sys.stderr.flush()
-        
         # Small delay to ensure terminal is ready
         time.sleep(0.1)
     
-    def _print_menu(self, title: str, options: list, show_status: bool = False):
+    async def _ainput(self, prompt: str = "") -> str:
+        """Read a line from stdin without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        if sys.platform == 'win32':
+            return await loop.run_in_executor(None, input, prompt)
+        
+        # Wait for stdin to become readable instead of parking a thread in input(),
+        # so a pending prompt can be cancelled cleanly on shutdown
+        sys.stdout.write(prompt)
+        sys.stdout.flush()
+        fd = sys.stdin.fileno()
+        while b'\n' not in self._stdin_buffer:
+            ready = loop.create_future()
+            loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                if self._stdin_buffer:
+                    break
+                raise EOFError
+            self._stdin_buffer += chunk
+        
+        line, _, self._stdin_buffer = self._stdin_buffer.partition(b'\n')
+        return line.decode(sys.stdin.encoding or 'utf-8', errors='replace').rstrip('\r')
+    
+    def _emit(self, *lines: str):
+        """Write a block of lines to stdout in a single syscall where possible"""
+        sys.stdout.flush()
+        try:
+            fd = sys.stdout.fileno()
+        except (AttributeError, OSError, ValueError):
+            fd = None
+        start = 0
+        if fd is not None and hasattr(os, 'writev'):
+            encoding = sys.stdout.encoding or 'utf-8'
+            parts = [f"{line}\n".encode(encoding, errors='replace') for line in lines]
+            try:
+                # One writev per IOV_MAX buffers; listings can have a block per user
+                for start in range(0, len(parts), IOV_MAX):
+                    chunk = parts[start:start + IOV_MAX]
+                    written = os.writev(fd, chunk)
+                    remaining = b''.join(chunk)[written:]
+                    while remaining:
+                        remaining = remaining[os.write(fd, remaining):]
+                return
+            except OSError:
+                pass  # Earlier chunks were fully written; write the rest below
+        
+        # No writev on Windows (or stdout is not a real file, or writev failed)
+        sys.stdout.write(''.join(f"{line}\n" for line in lines[start:]))
+        sys.stdout.flush()
+    
+    def _print_menu(self, title: str, options: Iterable[str], show_status: bool = False):
         """Print a menu with the given title and options"""
         self._clear_screen()
         
-        # Print header
-        print("=" * 50, flush=True)
-        print(f"ArkanisBot Admin Control Panel{' - ' + title if title != 'Main Menu' else ''}", flush=True)
-        print("=" * 50, flush=True)
-        print(f"Current Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", flush=True)
-        print("-" * 50, flush=True)
+        # Header; only the clock line changes between redraws
+        header, body = self._render_menu(title, options)
+        lines = [
+            header,
+            f"Current Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            "-" * 50
+        ]
         
-        # Print status if requested
+        # Status if requested
         if show_status:
-            status = "🟢 Running" if (self.controlbot_process and self.controlbot_process.poll() is None) else "🔴 Stopped"
-            print(f"\nCurrent Status: {status}", flush=True)
+            status = "🟢 Running" if self._is_running() else "🔴 Stopped"
+            lines.append(f"\nCurrent Status: {status}")
         
-        # Print menu options
-        print(f"\n{title}:", flush=True)
-        for option in options:
-            print(option, flush=True)
-        print("-" * 50, flush=True)
+        # Menu options
+        lines.append(body)
+        self._emit(*lines)
+    
+    def _render_menu(self, title: str, options: Iterable[str]) -> Tuple[str, str]:
+        """Return the static header and options block of a menu, building them once per title"""
+        rendered = self._menu_cache.get(title)
+        if rendered is None:
+            header = "\n".join((
+                "=" * 50,
+                f"ArkanisBot Admin Control Panel{' - ' + title if title != 'Main Menu' else ''}",
+                "=" * 50
+            ))
+            body = "\n".join((f"\n{title}:", *options, "-" * 50))
+            rendered = self._menu_cache[title] = (header, body)
+        return rendered
     
     async def _handle_configuration(self):
         """Handle configuration menu"""
         while True:
-            # Define configuration menu options
-            config_menu = [
-                "1. View Current Configuration",
-                "2. Edit API Credentials",
-                "3. Edit Rate Limits",
-                "4. Edit System Parameters",
-                "\n0. Back to Main Menu"
-            ]
+            self._print_menu("Configuration", self._CONFIG_MENU)
             
-            self._print_menu("Configuration", config_menu)
-            
-            choice = input("\nEnter your choice: ").strip()
-            sys.stdout.flush()
+            choice = (await self._ainput("\nEnter your choice: ")).strip()
             
             if choice == "1":
                 self._clear_screen()
@@ -104,15 +275,13 @@ class MainBotFoundation:
                     if key in ['api_hash', 'api_id']:
                         value = f"{value[:4]}..." if value else "Not set"
                     print(f"{key}: {value}", flush=True)
-                input("\nPress Enter to continue...")
-                sys.stdout.flush()
+                await self._ainput("\nPress Enter to continue...")
             
             elif choice == "2":
                 self._clear_screen()
                 print("\nEdit API Credentials:", flush=True)
-                api_id = input("Enter API ID (press Enter to keep current): ").strip()
-                api_hash = input("Enter API Hash (press Enter to keep current): ").strip()
-                sys.stdout.flush()
+                api_id = (await self._ainput("Enter API ID (press Enter to keep current): ")).strip()
+                api_hash = (await self._ainput("Enter API Hash (press Enter to keep current): ")).strip()
                 
                 if api_id:
                     self.config['api_id'] = api_id
@@ -120,106 +289,99 @@ class MainBotFoundation:
                     self.config['api_hash'] = api_hash
                 
                 print("\nCredentials updated!", flush=True)
-                input("Press Enter to continue...")
-                sys.stdout.flush()
+                await self._ainput("Press Enter to continue...")
             
             elif choice == "0":
                 break
             else:
-                print("\nInvalid choice. Please try again.", flush=True)
-                await asyncio.sleep(1)
+                await self._ainput("\nInvalid choice. Press Enter to continue...")
     
     async def _handle_user_settings(self):
         """Handle user settings menu"""
         while True:
-            # Define user settings menu options
-            user_menu = [
-                "1. View Whitelisted Users",
-                "2. Add User to Whitelist",
-                "3. Remove User from Whitelist",
-                "4. Register Whitelisted User",
-                "\n0. Back to Main Menu"
-            ]
-            
-            self._print_menu("User Settings", user_menu)
+            self._print_menu("User Settings", self._USER_MENU)
             
-            choice = input("\nEnter your choice: ").strip()
-            sys.stdout.flush()
+            choice = (await self._ainput("\nEnter your choice: ")).strip()
             
             if choice == "1":
                 self._clear_screen()
                 print("\nWhitelisted Users:", flush=True)
-                users = whitelist_manager.get_all_users()
+                users = self._get_users()
                 if users:
+                    blocks = []
                     for user_id, data in users.items():
-                        status = "✅ Registered" if data['registered'] else "⏳ Not Registered"
-                        print(f"\nUser ID: {user_id}", flush=True)
-                        print(f"Added: {data['added_at']}", flush=True)
-                        print(f"Status: {status}", flush=True)
-                        print(f"API ID: {data['api_id']}", flush=True)
-                        print("-" * 30, flush=True)
+                        status = "✅ Registered" if data.registered else "⏳ Not Registered"
+                        blocks.append(
+                            f"\nUser ID: {user_id}\n"
+                            f"Added: {data.added_at}\n"
+                            f"Status: {status}\n"
+                            f"API ID: {data.api_id}\n"
+                            f"{'-' * 30}"
+                        )
+                    self._emit(*blocks)
                 else:
                     print("\nNo users in whitelist.", flush=True)
-                input("\nPress Enter to continue...")
-                sys.stdout.flush()
+                await self._ainput("\nPress Enter to continue...")
                 
             elif choice == "2":
                 self._clear_screen()
                 print("\nAdd User to Whitelist:", flush=True)
                 try:
-                    user_id = int(input("Enter Telegram User ID: ").strip())
-                    api_id = input("Enter API ID (from my.telegram.org): ").strip()
-                    api_hash = input("Enter API Hash (from my.telegram.org): ").strip()
+                    user_id = int((await self._ainput("Enter Telegram User ID: ")).strip())
+                    api_id = (await self._ainput("Enter API ID (from my.telegram.org): ")).strip()
+                    api_hash = (await self._ainput("Enter API Hash (from my.telegram.org): ")).strip()
                     
                     if whitelist_manager.is_whitelisted(user_id):
                         print("\n❌ User is already whitelisted.", flush=True)
                     else:
                         success = whitelist_manager.add_user(user_id, api_id, api_hash)
                         if success:
+                            self._invalidate_users()
                             print(f"\n✅ User {user_id} has been added to the whitelist.", flush=True)
                         else:
                             print("\n❌ Failed to add user to whitelist.", flush=True)
                 except ValueError:
                     print("\n❌ Invalid user ID. Please enter a valid number.", flush=True)
-                input("\nPress Enter to continue...")
-                sys.stdout.flush()
+                await self._ainput("\nPress Enter to continue...")
             
             elif choice == "3":
                 self._clear_screen()
                 print("\nRemove User from Whitelist:", flush=True)
-                users = whitelist_manager.get_all_users()
+                users = self._get_users()
                 
                 if not users:
                     print("\nNo users in whitelist.", flush=True)
-                    input("\nPress Enter to continue...")
-                    sys.stdout.flush()
+                    await self._ainput("\nPress Enter to continue...")
                     continue
                 
                 # Show numbered list of users
                 user_list = list(users.items())
-                print("\nSelect a user to remove:", flush=True)
+                blocks = ["\nSelect a user to remove:"]
                 for idx, (user_id, data) in enumerate(user_list, 1):
-                    status = "✅ Registered" if data['registered'] else "⏳ Not Registered"
-                    print(f"\n{idx}. User ID: {user_id}", flush=True)
-                    print(f"   Added: {data['added_at']}", flush=True)
-                    print(f"   Status: {status}", flush=True)
-                    print(f"   API ID: {data['api_id']}", flush=True)
-                    print("-" * 30, flush=True)
-                
-                print("\n0. Cancel", flush=True)
+                    status = "✅ Registered" if data.registered else "⏳ Not Registered"
+                    blocks.append(
+                        f"\n{idx}. User ID: {user_id}\n"
+                        f"   Added: {data.added_at}\n"
+                        f"   Status: {status}\n"
+                        f"   API ID: {data.api_id}\n"
+                        f"{'-' * 30}"
+                    )
+                blocks.append("\n0. Cancel")
+                self._emit(*blocks)
                 
                 try:
-                    choice = input("\nEnter number: ").strip()
+                    choice = (await self._ainput("\nEnter number: ")).strip()
                     if choice == "0":
                         continue
                     
                     idx = int(choice)
                     if 1 <= idx <= len(user_list):
                         user_id = int(user_list[idx-1][0])
-                        confirm = input(f"\nAre you sure you want to remove user {user_id}? (y/N): ").strip().lower()
+                        confirm = (await self._ainput(f"\nAre you sure you want to remove user {user_id}? (y/N): ")).strip().lower()
                         if confirm == 'y':
                             success = whitelist_manager.remove_user(user_id)
                             if success:
+                                self._invalidate_users()
                                 print(f"\n✅ User {user_id} has been removed from the whitelist.", flush=True)
                             else:
                                 print("\n❌ Failed to remove user from whitelist.", flush=True)
@@ -229,40 +391,39 @@ class MainBotFoundation:
                         print("\n❌ Invalid selection.", flush=True)
                 except ValueError:
                     print("\n❌ Invalid input. Please enter a number.", flush=True)
-                input("\nPress Enter to continue...")
-                sys.stdout.flush()
+                await self._ainput("\nPress Enter to continue...")
             
             elif choice == "4":
                 self._clear_screen()
                 print("\nRegister Whitelisted User:", flush=True)
                 
                 # Get all unregistered whitelisted users
-                users = whitelist_manager.get_all_users()
+                users = self._get_users()
                 unregistered_users = {
                     user_id: data for user_id, data in users.items() 
-                    if not data.get('registered', False)
+                    if not data.registered
                 }
                 
                 if not unregistered_users:
                     print("\n❌ No unregistered users found in whitelist.", flush=True)
-                    input("\nPress Enter to continue...")
-                    sys.stdout.flush()
+                    await self._ainput("\nPress Enter to continue...")
                     continue
                 
                 # Show menu of unregistered users
-                print("\nSelect a user to register:", flush=True)
                 user_list = list(unregistered_users.items())
+                blocks = ["\nSelect a user to register:"]
                 for idx, (user_id, data) in enumerate(user_list, 1):
-                    added_date = data.get('added_at', 'Unknown')
-                    print(f"{idx}. User ID: {user_id}", flush=True)
-                    print(f"   Added: {added_date}", flush=True)
-                    print(f"   API ID: {data['api_id']}", flush=True)
-                    print("-" * 30, flush=True)
-                
-                print("\n0. Cancel", flush=True)
+                    blocks.append(
+                        f"{idx}. User ID: {user_id}\n"
+                        f"   Added: {data.added_at or 'Unknown'}\n"
+                        f"   API ID: {data.api_id}\n"
+                        f"{'-' * 30}"
+                    )
+                blocks.append("\n0. Cancel")
+                self._emit(*blocks)
                 
                 try:
-                    selection = input("\nEnter number of user to register: ").strip()
+                    selection = (await self._ainput("\nEnter number of user to register: ")).strip()
                     if selection == "0":
                         continue
                     
@@ -272,70 +433,12 @@ class MainBotFoundation:
                             raise ValueError("Invalid selection")
                         
                         user_id, user_data = user_list[idx]
-                        phone = input("\nEnter user's phone number (international format, e.g. +1234567890): ").strip()
+                        phone = (await self._ainput("\nEnter user's phone number (international format, e.g. +1234567890): ")).strip()
                         
                         # Start registration process
                         print(f"\nAttempting to register User {user_id}...", flush=True)
                         
-                        # Loop for phone number attempts
-                        max_phone_attempts = 3
-                        registration_successful = False
-                        
-                        for phone_attempt in range(max_phone_attempts):
-                            try:
-                                success, result = await whitelist_manager.register_user(user_id, phone)
-                                
-                                if success:
-                                    print("\n✅ Verification code has been sent to the user's phone.", flush=True)
-                                    print("⚠️ You have 2 minutes to enter the code before it expires!", flush=True)
-                                    print("Enter the code as soon as you receive it.", flush=True)
-                                    
-                                    # Loop for code verification attempts
-                                    max_code_attempts = 3
-                                    for code_attempt in range(max_code_attempts):
-                                        try:
-                                            code = input("\nEnter the verification code from user (or 'r' to request new code): ").strip()
-                                            
-                                            if code.lower() == 'r':
-                                                print("\nRequesting new verification code...", flush=True)
-                                                break  # Break inner loop to request new code
-                                            
-                                            # Verify the code
-                                            verify_success = await whitelist_manager.verify_code(user_id, code)
-                                            
-                                            if verify_success:
-                                                print(f"\n✅ User {user_id} has been successfully registered!", flush=True)
-                                                registration_successful = True
-                                                break  # Break the code verification loop
-                                            else:
-                                                remaining = max_code_attempts - code_attempt - 1
-                                                print(f"\n❌ Verification failed. Please try again.", flush=True)
-                                                if remaining > 0:
-                                                    print(f"You have {remaining} attempts remaining.", flush=True)
-                                                else:
-                                                    print("\n❌ Maximum code attempts reached.", flush=True)
-                                                    break
-                                        
-                                        except Exception as e:
-                                            print(f"\n❌ Error during code verification: {str(e)}", flush=True)
-                                            logger.error(f"Code verification error for user {user_id}: {str(e)}")
-                                            if code_attempt < max_code_attempts - 1:
-                                                print("Trying again...", flush=True)
-                                            else:
-                                                print("\n❌ Maximum code attempts reached.", flush=True)
-                                                break
-                                
-                                if registration_successful:
-                                    break  # Break the phone number attempts loop if registration was successful
-                                
-                            except Exception as e:
-                                print(f"\n❌ Error during registration: {str(e)}", flush=True)
-                                logger.error(f"Registration error for user {user_id}: {str(e)}")
-                                if phone_attempt < max_phone_attempts - 1:
-                                    print("Trying again...", flush=True)
-                                else:
-                                    print("\n❌ Maximum registration attempts reached.", flush=True)
-                                    break
+                        await self._run_registration(user_id, phone)
                     
                     except ValueError:
                         print("\n❌ Invalid selection. Please enter a valid number.", flush=True)
@@ -344,39 +447,123 @@ class MainBotFoundation:
                     print(f"\n❌ An error occurred: {str(e)}", flush=True)
                     logger.error(f"Error during user registration: {str(e)}")
                 
-                input("\nPress Enter to continue...")
-                sys.stdout.flush()
+                await self._ainput("\nPress Enter to continue...")
             
             elif choice == "0":
                 break
             else:
-                print("\nInvalid choice. Please try again.", flush=True)
-                await asyncio.sleep(1)
+                await self._ainput("\nInvalid choice. Press Enter to continue...")
+    
+    async def _run_registration(self, user_id, phone: str) -> bool:
+        """Drive the send-code / verify-code exchange for a whitelisted user"""
+        loop = asyncio.get_running_loop()
+        error = "\n❌ {}"
+        step = RegistrationStep.SEND_CODE
+        requests_left = self.MAX_CODE_REQUESTS
+        codes_left = 0
+        sent_at = 0.0
+        
+        while step is not RegistrationStep.DONE:
+            if step is RegistrationStep.SEND_CODE:
+                if not requests_left:
+                    print(error.format("Maximum registration attempts reached."), flush=True)
+                    return False
+                requests_left -= 1
+                
+                try:
+                    success, result = await asyncio.wait_for(
+                        whitelist_manager.register_user(user_id, phone),
+                        timeout=self.CODE_TTL
+                    )
+                except Exception as e:
+                    print(error.format(f"Error during registration: {str(e)}"), flush=True)
+                    logger.error(f"Registration error for user {user_id}: {str(e)}")
+                    continue
+                
+                if not success:
+                    print(error.format(f"Failed to send verification code: {result}"), flush=True)
+                    continue
+                
+                print("\n✅ Verification code has been sent to the user's phone.", flush=True)
+                print("⚠️ You have 2 minutes to enter the code before it expires!", flush=True)
+                print("Enter the code as soon as you receive it.", flush=True)
+                sent_at = loop.time()
+                codes_left = self.MAX_CODE_ATTEMPTS
+                step = RegistrationStep.AWAIT_CODE
+                continue
+            
+            # RegistrationStep.AWAIT_CODE
+            code = (await self._ainput("\nEnter the verification code from user (or 'r' to request new code): ")).strip()
+            if code.lower() == 'r':
+                print("\nRequesting new verification code...", flush=True)
+                step = RegistrationStep.SEND_CODE
+                continue
+            
+            time_left = self.CODE_TTL - (loop.time() - sent_at)
+            try:
+                if time_left <= 0:
+                    raise asyncio.TimeoutError
+                verified = await asyncio.wait_for(
+                    whitelist_manager.verify_code(user_id, code),
+                    timeout=time_left
+                )
+            except asyncio.TimeoutError:
+                print(error.format("Verification code expired. Requesting a new one..."), flush=True)
+                step = RegistrationStep.SEND_CODE
+                continue
+            except Exception as e:
+                print(error.format(f"Error during code verification: {str(e)}"), flush=True)
+                logger.error(f"Code verification error for user {user_id}: {str(e)}")
+                verified = False
+            
+            if verified:
+                self._invalidate_users()
+                print(f"\n✅ User {user_id} has been successfully registered!", flush=True)
+                step = RegistrationStep.DONE
+                continue
+            
+            codes_left -= 1
+            if codes_left:
+                print(error.format("Verification failed. Please try again."), flush=True)
+                print(f"You have {codes_left} attempts remaining.", flush=True)
+            else:
+                print(error.format("Maximum code attempts reached."), flush=True)
+                step = RegistrationStep.SEND_CODE
+        
+        return True
+    
+    def _check_postgres(self):
+        """Open (and release) a PostgreSQL connection, raising on failure"""
+        with db_manager.engine.connect():
+            pass
     
     async def _handle_database_settings(self):
         """Handle database settings menu"""
         while True:
             self._clear_screen()
-            print("\nDatabase Settings:")
-            print("1. View Database Status")
-            print("2. Test Connections")
-            print("3. Backup Database")
-            print("4. Clear Cache")
-            print("\n0. Back to Main Menu")
+            self._emit(*self._DATABASE_MENU)
             
-            choice = input("\nEnter your choice: ")
+            choice = await self._ainput("\nEnter your choice: ")
             
             if choice == "1":
-                # Test database connections
-                redis_status = "Connected" if db_manager.redis.ping() else "Disconnected"
+                # Test database connections off the event loop, bounded in time
+                try:
+                    ok = await asyncio.wait_for(db_manager.aredis.ping(), timeout=2.0)
+                    redis_status = "Connected" if ok else "Disconnected"
+                except asyncio.TimeoutError:
+                    redis_status = "Error: timed out"
+                except Exception as e:
+                    redis_status = f"Error: {str(e)}"
                 print(f"\nRedis Status: {redis_status}")
                 try:
-                    with db_manager.session_scope() as session:
-                        postgres_status = "Connected"
+                    await asyncio.wait_for(asyncio.to_thread(self._check_postgres), timeout=2.0)
+                    postgres_status = "Connected"
+                except asyncio.TimeoutError:
+                    postgres_status = "Error: timed out"
                 except Exception as e:
                     postgres_status = f"Error: {str(e)}"
                 print(f"PostgreSQL Status: {postgres_status}")
-                input("\nPress Enter to continue...")
+                await self._ainput("\nPress Enter to continue...")
             
             elif choice == "0":
                 break
@@ -385,27 +572,25 @@ class MainBotFoundation:
         """Handle sessions menu"""
         while True:
             self._clear_screen()
-            print("\nSessions Management:")
-            print("1. View Active Sessions")
-            print("2. View Session Logs")
-            print("3. Terminate Session")
-            print("4. Export Session Data")
-            print("\n0. Back to Main Menu")
+            self._emit(*self._SESSIONS_MENU)
             
-            choice = input("\nEnter your choice: ")
+            choice = await self._ainput("\nEnter your choice: ")
             
             if choice == "1":
                 sessions = await session_manager.list_sessions()
                 if sessions:
-                    print("\nActive Sessions:")
+                    blocks = ["\nActive Sessions:"]
                     for session in sessions:
-                        print(f"\nID: {session['session_id']}")
-                        print(f"Phone: {session['phone']}")
-                        print(f"Status: {'🟢 Active' if session['active'] else '🔴 Inactive'}")
-                        print(f"Last Used: {session['last_used']}")
+                        blocks.append(
+                            f"\nID: {session.session_id}\n"
+                            f"Phone: {session.phone}\n"
+                            f"Status: {'🟢 Active' if session.active else '🔴 Inactive'}\n"
+                            f"Last Used: {session.last_used}"
+                        )
+                    self._emit(*blocks)
                 else:
                     print("\nNo active sessions found.")
-                input("\nPress Enter to continue...")
+                await self._ainput("\nPress Enter to continue...")
             
             elif choice == "0":
                 break
@@ -434,76 +619,17 @@ class MainBotFoundation:
             
             print("\nStarting ControlBot...", flush=True)
             
-            # Start the bot in a new Python process
-            bot_script = os.path.join(os.path.dirname(__file__), '..', 'run_bot.py')
-            
-            # Create the run_bot.py script if it doesn't exist
-            if not os.path.exists(bot_script):
-                print(f"\nCreating bot script at {bot_script}", flush=True)
-                with open(bot_script, 'w') as f:
-                    f.write("""import asyncio
-import sys
-from control.bot import control_bot
-import logging
-import signal
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    stream=sys.stdout
-)
-
-# Handle graceful shutdown
-def signal_handler(signum, frame):
-    print("Received shutdown signal...", flush=True)
-    asyncio.create_task(shutdown())
-
-async def shutdown():
-    try:
-        await control_bot.stop()
-    except Exception as e:
-        print(f"Error during shutdown: {str(e)}", flush=True)
-    finally:
-        sys.exit(0)
-
-async def main():
-    try:
-        # Register signal handlers
-        signal.signal(signal.SIGTERM, signal_handler)
-        signal.signal(signal.SIGINT, signal_handler)
-        
-        print("Starting ControlBot...", flush=True)
-        await control_bot.start()
-    except KeyboardInterrupt:
-        print("Received shutdown signal...", flush=True)
-        await control_bot.stop()
-    except Exception as e:
-        print(f"Error starting ControlBot: {str(e)}", flush=True)
-        import traceback
-        print(f"Traceback:\\n{traceback.format_exc()}", flush=True)
-        sys.exit(1)
-
-if __name__ == "__main__":
-    try:
-        asyncio.run(main())
-    except Exception as e:
-        print(f"Fatal error: {str(e)}", flush=True)
-        sys.exit(1)
-""")
-                print("Bot script created successfully", flush=True)
-            
             # Create subprocess with pipes
             print("\nExecuting bot process...", flush=True)
             
             # Create the process without output capture first
+            # -u: the child writes each line as it is produced; output is read and decoded by
+            # monitor_output through the raw pipes, so the parent side stays binary
             self.controlbot_process = subprocess.Popen(
-                [sys.executable, bot_script],
+                [sys.executable, '-u', self.bot_script],
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 stdin=subprocess.PIPE,
-                bufsize=0,  # Unbuffered
-                universal_newlines=False,  # Binary mode
                 preexec_fn=os.setsid if sys.platform != 'win32' else None
             )
             
@@ -516,12 +642,13 @@ if __name__ == "__main__":
                 stdout, stderr = self.controlbot_process.communicate()
                 print("\nProcess output:", flush=True)
                 if stdout:
-                    print(f"\nStandard output:\n{stdout.decode()}", flush=True)
+                    print(f"\nStandard output:\n{stdout.decode('utf-8', errors='replace')}", flush=True)
                 if stderr:
-                    print(f"\nError output:\n{stderr.decode()}", flush=True)
+                    print(f"\nError output:\n{stderr.decode('utf-8', errors='replace')}", flush=True)
                 self.controlbot_process = None
                 return False
             
+            self._invalidate_status()
             print("\nControlBot process started successfully!", flush=True)
             print("The bot will continue running in the background.", flush=True)
             
@@ -533,7 +660,7 @@ if __name__ == "__main__":
             stderr_protocol = asyncio.StreamReaderProtocol(stderr_reader)
             
             # Get the event loop
-            loop = asyncio.get_event_loop()
+            loop = asyncio.get_running_loop()
             
             # Create connections
             await loop.connect_read_pipe(lambda: stdout_protocol, self.controlbot_process.stdout)
@@ -547,14 +674,14 @@ if __name__ == "__main__":
                             # Read output with timeout
                             stdout_line = await asyncio.wait_for(stdout_reader.readline(), timeout=0.1)
                             if stdout_line:
-                                line = stdout_line.decode().strip()
+                                line = stdout_line.decode('utf-8', errors='replace').strip()
                                 if line:
                                     print(f"[ControlBot] {line}", flush=True)
                             
                             # Check stderr
                             stderr_line = await asyncio.wait_for(stderr_reader.readline(), timeout=0.1)
                             if stderr_line:
-                                line = stderr_line.decode().strip()
+                                line = stderr_line.decode('utf-8', errors='replace').strip()
                                 if line:
                                     print(f"[ControlBot Error] {line}", flush=True)
                             
@@ -565,7 +692,17 @@ if __name__ == "__main__":
                             print(f"[ControlBot Monitor] Error reading output: {str(e)}", flush=True)
                             await asyncio.sleep(0.1)
                     
-                    # Process has ended
+                    # Process has ended, print whatever is still buffered in the pipes
+                    for reader, prefix in ((stdout_reader, "[ControlBot]"), (stderr_reader, "[ControlBot Error]")):
+                        try:
+                            tail = await asyncio.wait_for(reader.read(), timeout=1.0)
+                        except asyncio.TimeoutError:
+                            continue
+                        for line in tail.decode('utf-8', errors='replace').splitlines():
+                            line = line.strip()
+                            if line:
+                                print(f"{prefix} {line}", flush=True)
+                    
                     if self.controlbot_process:
                         exit_code = self.controlbot_process.poll()
                         print(f"\n[ControlBot] Process ended with exit code: {exit_code}", flush=True)
@@ -580,58 +717,63 @@ if __name__ == "__main__":
                         self.controlbot_process = None
             
             # Start monitoring in background
-            asyncio.create_task(monitor_output())
+            self._monitor_task = asyncio.create_task(monitor_output())
             return True
             
         except Exception as e:
             logger.error(f"Failed to start ControlBot: {e}")
             print(f"\nFailed to start ControlBot: {str(e)}", flush=True)
-            import traceback
             print(f"Error details:\n{traceback.format_exc()}", flush=True)
             if self.controlbot_process:
                 self.controlbot_process.terminate()
                 self.controlbot_process = None
             return False
 
+    def _terminate_controlbot(self):
+        """Send SIGTERM to the ControlBot process group"""
+        if sys.platform == 'win32':
+            self.controlbot_process.terminate()
+        else:
+            # The child runs in its own session, so one killpg reaches all of its children
+            os.killpg(os.getpgid(self.controlbot_process.pid), signal.SIGTERM)
+    
     async def _stop_controlbot(self):
         """Stop the ControlBot process"""
         if not self.controlbot_process:
             print("\nControlBot is not running!")
             return False
         
+        process = self.controlbot_process
         try:
             print("\nStopping ControlBot...", flush=True)
             
-            # Import the control_bot instance
+            # Call stop directly; control.bot (and Telethon) is only imported when needed
             from control.bot import control_bot
-            
-            # Call stop directly
             await control_bot.stop()
             
-            # Wait for the process to stop
+            # Wait for the process to stop without blocking the event loop
             try:
                 await asyncio.sleep(1)  # Give time for logs to be written
-                self.controlbot_process.terminate()
-                await asyncio.sleep(0.5)  # Give process time to terminate
-                
-                if self.controlbot_process.poll() is None:
+                self._terminate_controlbot()
+                try:
+                    await asyncio.to_thread(process.wait, 2.0)
+                except subprocess.TimeoutExpired:
                     print("\nForcing ControlBot to stop...", flush=True)
-                    self.controlbot_process.kill()
-                    await asyncio.sleep(0.5)  # Give process time to die
+                    process.kill()
+                    await asyncio.to_thread(process.wait)
             except Exception as e:
                 print(f"\nError during process cleanup: {e}", flush=True)
             
-            # Get any remaining output
-            try:
-                stdout, stderr = self.controlbot_process.communicate(timeout=2)
-                if stdout:
-                    print(f"\nBot output:\n{stdout.decode()}", flush=True)
-                if stderr:
-                    print(f"\nBot errors:\n{stderr.decode()}", flush=True)
-            except Exception as e:
-                print(f"\nError getting process output: {e}", flush=True)
+            # Let the output monitor drain the pipes so no tail lines are lost
+            if self._monitor_task:
+                try:
+                    await asyncio.wait_for(self._monitor_task, timeout=2.0)
+                except Exception as e:
+                    print(f"\nError getting process output: {e}", flush=True)
+                self._monitor_task = None
             
             self.controlbot_process = None
+            self._invalidate_status()
             print("\nControlBot stopped successfully!")
             return True
             
@@ -650,49 +792,33 @@ if __name__ == "__main__":
     async def _handle_controlbot_settings(self):
         """Handle ControlBot settings menu"""
         while True:
-            # Define ControlBot menu options
-            controlbot_menu = [
-                "1. Start ControlBot",
-                "2. Stop ControlBot",
-                "3. View Bot Status",
-                "4. Edit Bot Settings",
-                "5. View Command Permissions",
-                "6. Edit Command Permissions",
-                "\n0. Back to Main Menu"
-            ]
-            
-            self._print_menu("ControlBot Settings", controlbot_menu, show_status=True)
-            
-            choice = input("\nEnter your choice: ").strip()
-            sys.stdout.flush()
+            self._print_menu("ControlBot Settings", self._CONTROLBOT_MENU, show_status=True)
+            
+            choice = (await self._ainput("\nEnter your choice: ")).strip()
             
             if choice == "1":
                 await self._start_controlbot()
-                input("\nPress Enter to continue...")
-                sys.stdout.flush()
+                await self._ainput("\nPress Enter to continue...")
             elif choice == "2":
                 await self._stop_controlbot()
-                input("\nPress Enter to continue...")
-                sys.stdout.flush()
+                await self._ainput("\nPress Enter to continue...")
             elif choice == "3":
                 self._clear_screen()
                 print("\nControlBot Status:", flush=True)
-                status = "🟢 Running" if (self.controlbot_process and self.controlbot_process.poll() is None) else "🔴 Stopped"
+                status = "🟢 Running" if self._is_running() else "🔴 Stopped"
                 print(f"Status: {status}", flush=True)
-                if self.controlbot_process and self.controlbot_process.poll() is None:
+                if self._is_running():
                     from control.bot import control_bot
                     instances = len(control_bot.user_instances)
                     print(f"Active User Instances: {instances}", flush=True)
                     print("\nLast 5 Authentication States:", flush=True)
                     for user_id, state in list(control_bot.auth_states.items())[:5]:
                         print(f"User {user_id}: {state['step']}", flush=True)
-                input("\nPress Enter to continue...")
-                sys.stdout.flush()
+                await self._ainput("\nPress Enter to continue...")
             elif choice == "0":
                 break
             else:
-                print("\nInvalid choice. Please try again.", flush=True)
-                await asyncio.sleep(1)
+                await self._ainput("\nInvalid choice. Press Enter to continue...")
     
     async def _handle_shutdown(self):
         """Handle system shutdown"""
@@ -700,78 +826,92 @@ if __name__ == "__main__":
         
         # Ask if user wants to stop ControlBot
         if self.controlbot_process and self.controlbot_process.poll() is None:
-            choice = input("\nDo you want to stop the ControlBot as well? (y/N): ").strip().lower()
+            choice = (await self._ainput("\nDo you want to stop the ControlBot as well? (y/N): ")).strip().lower()
             if choice == 'y':
                 print("Stopping ControlBot...")
                 await self._stop_controlbot()
             else:
                 print("ControlBot will continue running in the background.")
         
-        # Close all active sessions
-        sessions = await session_manager.list_sessions()
-        for session in sessions:
-            if session['active']:
-                print(f"Ending session {session['session_id']}...")
-                await session_manager.end_session(session['session_id'])
+        # Close all active sessions concurrently; each disconnect is a network round trip
+        active = [session.session_id for session in await session_manager.list_sessions() if session.active]
+        for session_id in active:
+            print(f"Ending session {session_id}...")
+        await asyncio.gather(
+            *(session_manager.end_session(session_id) for session_id in active),
+            return_exceptions=True
+        )
+        await session_manager.flush()
         
         # Close database connections
         print("Closing database connections...")
-        db_manager.clear_cache()
+        await db_manager.aclear_cache(force=True)
         
         print("Shutdown complete!")
-        self.running = False
+        self._shutdown_event.set()
+    
+    def _sync_shutdown(self):
+        """Signal handler: stop the menu loop and the ControlBot process"""
+        self._shutdown_event.set()
+        if self.controlbot_process and self.controlbot_process.poll() is None:
+            self._shutdown_task = asyncio.create_task(self._stop_controlbot())
+    
+    def install_signal_handlers(self):
+        """Handle SIGINT/SIGTERM inside the running event loop"""
+        if sys.platform == 'win32':
+            return  # add_signal_handler is not supported by the Windows event loops
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._sync_shutdown)
+    
+    async def _run_main_menu(self):
+        """Main menu loop, runs until the operator exits or shuts down"""
+        while not self._shutdown_event.is_set():
+            # Display menu
+            self._print_menu("Main Menu", self._MAIN_MENU)
+            
+            # Get user input
+            choice = (await self._ainput("\nEnter your choice: ")).strip()
+            
+            # Process the choice in a controlled manner
+            if choice in ["1", "2", "3", "4", "5", "6", "0"]:
+                if choice == "1":
+                    await self._handle_configuration()
+                elif choice == "2":
+                    await self._handle_user_settings()
+                elif choice == "3":
+                    await self._handle_database_settings()
+                elif choice == "4":
+                    await self._handle_sessions()
+                elif choice == "5":
+                    await self._handle_controlbot_settings()
+                elif choice == "6":
+                    print("\nInitiating shutdown...", flush=True)
+                    await self._handle_shutdown()
+                    break
+                elif choice == "0":
+                    print("\nExiting admin panel...", flush=True)
+                    break
+            else:
+                await self._ainput("\nInvalid choice. Press Enter to continue...")
     
     async def start(self):
         """Start the admin control panel"""
-        # Define main menu options once
-        main_menu = [
-            "1. Configuration",
-            "2. User Settings",
-            "3. Database Settings",
-            "4. Sessions",
-            "5. ControlBot Settings",
-            "6. Shutdown",
-            "\n0. Exit"
-        ]
+        self.install_signal_handlers()
+        await whitelist_manager.initialize()  # Later accesses refresh it in the background
         
+        menu = asyncio.create_task(self._run_main_menu())
+        shutdown = asyncio.create_task(self._shutdown_event.wait())
         try:
-            while self.running:
-                # Wait a small amount to ensure terminal is ready
-                await asyncio.sleep(0.1)
-                
-                # Display menu
-                self._print_menu("Main Menu", main_menu)
-                
-                # Get user input
-                choice = input("\nEnter your choice: ").strip()
-                
-                # Process the choice in a controlled manner
-                if choice in ["1", "2", "3", "4", "5", "6", "0"]:
-                    if choice == "1":
-                        await self._handle_configuration()
-                    elif choice == "2":
-                        await self._handle_user_settings()
-                    elif choice == "3":
-                        await self._handle_database_settings()
-                    elif choice == "4":
-                        await self._handle_sessions()
-                    elif choice == "5":
-                        await self._handle_controlbot_settings()
-                    elif choice == "6":
-                        print("\nInitiating shutdown...", flush=True)
-                        await asyncio.sleep(0.1)
-                        await self._handle_shutdown()
-                        break
-                    elif choice == "0":
-                        print("\nExiting admin panel...", flush=True)
-                        break
-                else:
-                    print("\nInvalid choice. Please try again.", flush=True)
-                    await asyncio.sleep(1)
-                
-                # Ensure output is flushed before next iteration
-                sys.stdout.flush()
-                sys.stderr.flush()
+            # Sleep until either the menu returns or a shutdown is signalled
+            await asyncio.wait((menu, shutdown), return_when=asyncio.FIRST_COMPLETED)
+            shutdown.cancel()
+            if menu.done():
+                menu.result()  # Re-raise errors from the menu loop
+            else:
+                # Shutdown requested by a signal: abandon the pending prompt
+                menu.cancel()
+                await asyncio.gather(menu, return_exceptions=True)
                 
         except KeyboardInterrupt:
             print("\nReceived shutdown signal...", flush=True)
@@ -780,52 +920,33 @@ if __name__ == "__main__":
             logger.critical(f"Admin panel crashed: {e}")
             raise
         finally:
+            # Let a signal-triggered ControlBot stop finish before exiting
+            if self._shutdown_task:
+                await asyncio.gather(self._shutdown_task, return_exceptions=True)
+            
             # Ensure final messages are displayed
             print("\nAdmin panel stopped.", flush=True)
-            sys.stdout.flush()
-            sys.stderr.flush()
 
 def main():
     """Main entry point"""
+    # Selector loop on Windows for proper terminal handling
+    loop_factory = asyncio.SelectorEventLoop if sys.platform == 'win32' else None
     try:
-        # Get or create event loop
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        # Initialize the admin panel
-        admin_panel = MainBotFoundation()
-        
-        # Run the admin panel in the event loop
-        loop.run_until_complete(admin_panel.start())
-        
+        # The runner cancels and awaits any pending tasks on exit
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            runner.run(MainBotFoundation().start())
     except KeyboardInterrupt:
         logger.info("Admin panel stopped by user.")
     except Exception as e:
         logger.critical(f"Admin panel crashed: {e}")
         raise
     finally:
-        # Clean up
-        try:
-            pending = asyncio.all_tasks(loop)
-            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
-        except Exception:
-            pass
-        
-        loop.close()
-        
         # Force flush any remaining output
         sys.stdout.flush()
         sys.stderr.flush()
 
 if __name__ == "__main__":
-    # Ensure proper terminal handling
-    if sys.platform == 'win32':
-        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    
     # Disable output buffering
     sys.stdout.reconfigure(line_buffering=True)
     
-    main() 
\ No newline at end of file
+    main()
@@ -1,27 +1,201 @@
-from typing import Dict, Optional
-from datetime import datetime
-from telethon import TelegramClient
-from telethon.sessions import StringSession
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Set, Tuple
+from datetime import datetime, timezone
 import os
-import json
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+import orjson
 from utils.logger import logger
+from utils.database import db_manager
 from utils.security import security_manager
 
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock guards the manifest
+    fcntl = None
+
+if TYPE_CHECKING:
+    from telethon import TelegramClient
+
+class SessionRow(NamedTuple):
+    """Summary of a stored session as returned by SessionManager.list_sessions"""
+    session_id: str
+    phone: Optional[str]
+    created_at: Optional[str]
+    last_used: Optional[str]
+    active: bool
+
+# Deletes the ASCII punctuation/whitespace that may appear in phone numbers
+_PHONE_SCRUB = str.maketrans('', '', ''.join(chr(c) for c in range(128) if not chr(c).isalnum()))
+
 class SessionManager:
+    PLAINTEXT_CACHE_TTL = 300  # seconds
+    LAST_USED_FLUSH_DELAY = 5  # seconds to coalesce last_used updates into one manifest write
+    
     def __init__(self):
         self.api_id = int(os.getenv('API_ID', '0'))
         self.api_hash = os.getenv('API_HASH', '')
-        self.active_sessions: Dict[str, TelegramClient] = {}
+        self.active_sessions: Dict[str, 'TelegramClient'] = {}
+        # Parsed session files keyed by phone: phone -> (mtime, data)
+        self._session_cache: Dict[str, Tuple[float, dict]] = {}
+        # Decrypted session strings: session_id -> (expires_at, encrypted, plaintext)
+        self._plaintext_cache: Dict[str, Tuple[float, str, str]] = {}
+        # Connected clients waiting for a login code: phone -> (client, phone_code_hash)
+        self._pending_clients: Dict[str, Tuple['TelegramClient', str]] = {}
         self.sessions_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sessions')
         # Create sessions directory if it doesn't exist
         if not os.path.exists(self.sessions_dir):
             os.makedirs(self.sessions_dir)
             logger.info(f"Created sessions directory at {self.sessions_dir}")
+        # Manifest of session metadata: session_id -> {session_id, phone, created_at, last_used}.
+        # The admin panel, ControlBot and API processes share it, so every write re-reads and
+        # merges under a file lock, and readers reload it when its (mtime, size) changes
+        self._index_path = os.path.join(self.sessions_dir, '_index.json')
+        self._index_lock_path = os.path.join(self.sessions_dir, '_index.lock')
+        self._index_lock = threading.Lock()  # File I/O also runs in worker threads
+        self._index_stamp: Optional[Tuple[int, int]] = None
+        # Sessions whose last_used changed since the manifest was last written
+        self._dirty_sessions: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._index: Dict[str, dict] = self._load_index()
+    
+    @contextmanager
+    def _manifest_lock(self):
+        """Hold the manifest against other threads and, where supported, other processes"""
+        with self._index_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._index_lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _read_index_file(self) -> Tuple[Dict[str, dict], Tuple[int, int]]:
+        """Read the manifest from disk along with its (mtime, size) stamp"""
+        with open(self._index_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            return orjson.loads(f.read()), (st.st_mtime_ns, st.st_size)
+    
+    def _load_index(self) -> Dict[str, dict]:
+        """Load the session manifest, rebuilding it from the session files if missing"""
+        try:
+            index, self._index_stamp = self._read_index_file()
+            return index
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Failed to read session index, rebuilding: {str(e)}")
+        
+        index = {}
+        for filename in os.listdir(self.sessions_dir):
+            if not (filename.startswith('session_') and filename.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(self.sessions_dir, filename), 'rb') as f:
+                    data = orjson.loads(f.read())
+                if data.get('session_id'):
+                    index[data['session_id']] = self._index_entry(data)
+            except Exception as e:
+                logger.error(f"Error reading session file {filename}: {e}")
+        
+        self._index = {}
+        self._write_index(index)
+        logger.info(f"Rebuilt session index with {len(index)} sessions")
+        return self._index
+    
+    def _refresh_index(self) -> None:
+        """Reload the manifest if another process rewrote it since we last saw it"""
+        try:
+            st = os.stat(self._index_path)
+        except FileNotFoundError:
+            return
+        if (st.st_mtime_ns, st.st_size) == self._index_stamp:
+            return
+        with self._index_lock:
+            try:
+                self._adopt_index(*self._read_index_file())
+            except Exception as e:
+                logger.error(f"Failed to reload session index: {str(e)}")
+    
+    def _adopt_index(self, index: Dict[str, dict], stamp: Tuple[int, int]) -> None:
+        """Replace our manifest copy, keeping last_used updates not written yet (lock held)"""
+        for session_id in tuple(self._dirty_sessions):
+            if session_id in self._index and session_id in index:
+                index[session_id]['last_used'] = self._index[session_id]['last_used']
+        self._index, self._index_stamp = index, stamp
+    
+    @staticmethod
+    def _index_entry(session_data: dict) -> dict:
+        """Extract the manifest entry for a session"""
+        return {
+            'session_id': session_data['session_id'],
+            'phone': session_data.get('phone'),
+            'created_at': session_data.get('created_at'),
+            'last_used': session_data.get('last_used')
+        }
+    
+    def _write_index(self, changes: Dict[str, dict]) -> None:
+        """Merge changed entries into the on-disk manifest and atomically rewrite it"""
+        tmp_path = f"{self._index_path}.{os.getpid()}.tmp"
+        with self._manifest_lock():
+            # Start from the file, not our copy, so entries other processes added survive
+            try:
+                index, _ = self._read_index_file()
+            except (FileNotFoundError, orjson.JSONDecodeError):
+                index = dict(self._index)
+            for session_id, entry in changes.items():
+                index[session_id] = {**index.get(session_id, {}), **entry}
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(index, option=orjson.OPT_INDENT_2))
+            os.replace(tmp_path, self._index_path)
+            st = os.stat(self._index_path)
+            self._adopt_index(index, (st.st_mtime_ns, st.st_size))
+    
+    def _touch(self, session_id: str) -> None:
+        """Update last_used in the manifest and schedule a batched write"""
+        entry = self._index.get(session_id)
+        if not entry:
+            self._refresh_index()  # May have been created by another process
+            entry = self._index.get(session_id)
+            if not entry:
+                return
+        entry['last_used'] = datetime.now(timezone.utc).isoformat()
+        self._dirty_sessions.add(session_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+    
+    async def _flush_later(self) -> None:
+        """Write pending last_used updates after a short delay"""
+        await asyncio.sleep(self.LAST_USED_FLUSH_DELAY)
+        await self.flush()
+    
+    async def flush(self) -> None:
+        """Write pending last_used updates to the manifest now"""
+        task = self._flush_task
+        if task and task is not asyncio.current_task() and not task.done():
+            task.cancel()
+        if not self._dirty_sessions:
+            return
+        changes = {
+            session_id: dict(self._index[session_id])
+            for session_id in self._dirty_sessions if session_id in self._index
+        }
+        count = len(self._dirty_sessions)
+        self._dirty_sessions.clear()
+        try:
+            await asyncio.to_thread(self._write_index, changes)
+            logger.debug(f"Persisted last_used for {count} sessions")
+        except Exception as e:
+            logger.error(f"Failed to write session manifest: {str(e)}")
     
     def _get_session_path(self, phone: str) -> str:
         """Get the file path for a session file"""
         # Remove any special characters from phone number for filename
-        safe_phone = ''.join(c for c in phone if c.isalnum())
+        safe_phone = phone.translate(_PHONE_SCRUB)
         return os.path.join(self.sessions_dir, f"session_{safe_phone}.json")
 
     def save_session(self, session_id: str, session_data: dict) -> bool:
@@ -31,8 +205,15 @@ class SessionManager:
             file_path = self._get_session_path(session_data['phone'])
             # Add session_id to data for reference
             session_data['session_id'] = session_id
-            with open(file_path, 'w') as f:
-                json.dump(session_data, f, indent=2)
+            # Write to a temp file and rename so a crash never leaves a truncated session
+            tmp_path = f"{file_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(session_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+            self._session_cache.pop(session_data['phone'], None)
+            self._write_index({session_id: self._index_entry(session_data)})
             logger.info(f"Saved session {session_id} to file {file_path}")
             return True
         except Exception as e:
@@ -43,18 +224,57 @@ class SessionManager:
         """Load session data from file using phone number"""
         try:
             file_path = self._get_session_path(phone)
-            if not os.path.exists(file_path):
+            try:
+                mtime = os.stat(file_path).st_mtime
+            except FileNotFoundError:
                 logger.warning(f"Session file not found: {file_path}")
+                self._session_cache.pop(phone, None)
                 return None
             
-            with open(file_path, 'r') as f:
-                session_data = json.load(f)
+            cached = self._session_cache.get(phone)
+            if cached and cached[0] == mtime:
+                return cached[1].copy()
+            
+            with open(file_path, 'rb') as f:
+                session_data = orjson.loads(f.read())
+            self._session_cache[phone] = (mtime, session_data)
             logger.info(f"Loaded session for phone {phone} from file")
-            return session_data
+            return session_data.copy()
         except Exception as e:
             logger.error(f"Failed to load session for phone {phone}: {str(e)}")
             return None
 
+    def get_session_string(self, session_data: dict) -> Optional[str]:
+        """Decrypt the session string of loaded session data, memoized per session"""
+        session_id = session_data.get('session_id')
+        encrypted = session_data['session']
+        now = time.monotonic()
+        cached = self._plaintext_cache.get(session_id)
+        if cached and cached[0] > now and cached[1] == encrypted:
+            return cached[2]
+        
+        session_string = security_manager.decrypt_message(encrypted)
+        if session_string is not None and session_id:
+            self._plaintext_cache[session_id] = (now + self.PLAINTEXT_CACHE_TTL, encrypted, session_string)
+        return session_string
+
+    def _new_client(self, api_id: int, api_hash: str) -> 'TelegramClient':
+        """Create an unauthorized client for the login flow"""
+        # Telethon is imported on first use so the admin panel starts without it
+        from telethon import TelegramClient
+        from telethon.sessions import StringSession
+        
+        return TelegramClient(
+            StringSession(),
+            api_id,
+            api_hash,
+            device_model="ArkanisUserBot",
+            system_version="1.0",
+            app_version="1.0",
+            lang_code="en",
+            system_lang_code="en"
+        )
+
     async def create_session(self, phone: str, api_id: Optional[str] = None, api_hash: Optional[str] = None, reuse_session: bool = False) -> Optional[dict]:
         """Create a new Telegram session for a phone number or reuse existing one"""
         try:
@@ -64,9 +284,8 @@ class SessionManager:
                 if existing_session:
                     logger.info(f"[Session Flow] Reusing existing session for {phone}")
                     session_data = existing_session['session_data']
-                    # Update last used time
-                    session_data['last_used'] = datetime.utcnow().isoformat()
-                    self.save_session(existing_session['session_id'], session_data)
+                    # Update last used time; persisted with the next manifest flush
+                    self._touch(existing_session['session_id'])
                     return {
                         'session_id': session_data['session_id'],
                         'user_info': {
@@ -86,16 +305,7 @@ class SessionManager:
             client_api_hash = api_hash if api_hash else self.api_hash
             
             # Create a new Telegram client
-            client = TelegramClient(
-                StringSession(),
-                client_api_id,
-                client_api_hash,
-                device_model="ArkanisUserBot",
-                system_version="1.0",
-                app_version="1.0",
-                lang_code="en",
-                system_lang_code="en"
-            )
+            client = self._new_client(client_api_id, client_api_hash)
             
             # Start the client and get the session string
             await client.connect()
@@ -103,8 +313,10 @@ class SessionManager:
             # Send code request if not authorized
             if not await client.is_user_authorized():
                 logger.info(f"[Session Flow] Sending code request for {phone}")
-                await client.send_code_request(phone)
-                await client.disconnect()
+                sent_code = await client.send_code_request(phone)
+                # Keep the connection open so sign_in can reuse it with the same code hash
+                await self._discard_pending_client(phone)
+                self._pending_clients[phone] = (client, sent_code.phone_code_hash)
                 return None
             
             session_string = client.session.save()
@@ -118,11 +330,12 @@ class SessionManager:
             encrypted_session = security_manager.encrypt_message(session_string)
             
             # Store session data in file
+            now = datetime.now(timezone.utc).isoformat()  # Manifest timestamps are UTC-aware ISO strings
             session_data = {
                 'phone': phone,
                 'session': encrypted_session,
-                'created_at': datetime.utcnow().isoformat(),
-                'last_used': datetime.utcnow().isoformat(),
+                'created_at': now,
+                'last_used': now,
                 'user_id': me.id,
                 'username': me.username,
                 'first_name': me.first_name,
@@ -131,7 +344,7 @@ class SessionManager:
                 'api_hash': client_api_hash
             }
             
-            self.save_session(session_id, session_data)
+            await asyncio.to_thread(self.save_session, session_id, session_data)
             
             # Store the active client
             self.active_sessions[session_id] = client
@@ -149,10 +362,16 @@ class SessionManager:
                 await client.disconnect()
             return None
 
+    async def _discard_pending_client(self, phone: str) -> None:
+        """Disconnect and forget a client left waiting for a login code"""
+        pending = self._pending_clients.pop(phone, None)
+        if pending and pending[0].is_connected():
+            await pending[0].disconnect()
+
     async def get_session_by_phone(self, phone: str) -> Optional[dict]:
         """Find a session by phone number"""
         try:
-            session_data = self.load_session(phone)
+            session_data = await asyncio.to_thread(self.load_session, phone)
             if session_data:
                 return {
                     'session_id': session_data['session_id'],
@@ -175,11 +394,10 @@ class SessionManager:
                     await client.disconnect()
                 del self.active_sessions[session_id]
             
-            # Update last used time in session file
-            session_data = self.load_session(session_data['phone'])
-            if session_data:
-                session_data['last_used'] = datetime.utcnow().isoformat()
-                self.save_session(session_id, session_data)
+            self._plaintext_cache.pop(session_id, None)
+            
+            # Update last used time in the manifest; the session file only changes with session material
+            self._touch(session_id)
             
             logger.info(f"Ended session {session_id} (session file preserved)")
             return True
@@ -188,61 +406,42 @@ class SessionManager:
             logger.error(f"Failed to end session {session_id}: {str(e)}", exc_info=True)
             return False
     
-    async def list_sessions(self) -> list:
-        """List all active sessions"""
+    async def list_sessions(self) -> List[SessionRow]:
+        """List all known sessions"""
         try:
-            sessions = []
-            # List all session files in the sessions directory
-            if os.path.exists(self.sessions_dir):
-                for filename in os.listdir(self.sessions_dir):
-                    if filename.endswith('.json'):
-                        file_path = os.path.join(self.sessions_dir, filename)
-                        try:
-                            with open(file_path, 'r') as f:
-                                data = json.load(f)
-                                session_id = data.get('session_id')
-                                if session_id:
-                                    sessions.append({
-                                        'session_id': session_id,
-                                        'phone': data.get('phone'),
-                                        'created_at': data.get('created_at'),
-                                        'last_used': data.get('last_used'),
-                                        'active': session_id in self.active_sessions
-                                    })
-                        except Exception as e:
-                            logger.error(f"Error reading session file {filename}: {e}")
-                            continue
-            
-            return sessions
-            
+            await asyncio.to_thread(self._refresh_index)  # Pick up sessions other processes saved
+            active = self.active_sessions.keys()
+            return [
+                SessionRow(**entry, active=session_id in active)
+                for session_id, entry in self._index.items()
+            ]
         except Exception as e:
             logger.error(f"Failed to list sessions: {e}")
             return []
 
     async def sign_in(self, phone: str, code: str, api_id: Optional[str] = None, api_hash: Optional[str] = None) -> Optional[dict]:
         """Sign in with the provided verification code"""
+        from telethon.errors import SessionPasswordNeededError
+        
         try:
             # Use provided API credentials or fall back to bot's credentials
             client_api_id = int(api_id) if api_id else self.api_id
             client_api_hash = api_hash if api_hash else self.api_hash
             
-            # Create a new client
-            client = TelegramClient(
-                StringSession(),
-                client_api_id,
-                client_api_hash,
-                device_model="ArkanisUserBot",
-                system_version="1.0",
-                app_version="1.0",
-                lang_code="en",
-                system_lang_code="en"
-            )
+            # Reuse the client that requested the code, if any
+            pending = self._pending_clients.pop(phone, None)
+            if pending:
+                client, phone_code_hash = pending
+            else:
+                client = self._new_client(client_api_id, client_api_hash)
+                phone_code_hash = None
             
-            await client.connect()
+            if not client.is_connected():
+                await client.connect()
             
             try:
                 # Try signing in with the code
-                await client.sign_in(phone, code)
+                await client.sign_in(phone, code, phone_code_hash=phone_code_hash)
             except SessionPasswordNeededError:
                 logger.error(f"[Session Flow] 2FA is enabled for {phone}, cannot proceed")
                 await client.disconnect()
@@ -263,11 +462,12 @@ class SessionManager:
             encrypted_session = security_manager.encrypt_message(session_string)
             
             # Store in Redis
+            now = datetime.now(timezone.utc).isoformat()  # Manifest timestamps are UTC-aware ISO strings
             session_data = {
                 'phone': phone,
                 'session': encrypted_session,
-                'created_at': datetime.utcnow().isoformat(),
-                'last_used': datetime.utcnow().isoformat(),
+                'created_at': now,
+                'last_used': now,
                 'user_id': me.id,
                 'username': me.username,
                 'first_name': me.first_name,
@@ -276,9 +476,9 @@ class SessionManager:
                 'api_hash': client_api_hash
             }
             
-            db_manager.set_cache(
+            await db_manager.aset_cache(
                 f'session:{session_id}',
-                json.dumps(session_data),
+                orjson.dumps(session_data),
                 expire=86400 * 30
             )
             
@@ -23,35 +23,38 @@ class WhitelistedUser(Base):
     last_name = Column(String, nullable=True)
     user_metadata = Column(JSONB, nullable=True)  # For any additional data
 
+    # Keys emitted by to_dict, in order; datetime columns are serialized to ISO strings
+    _DICT_FIELDS = (
+        'user_id', 'api_id', 'api_hash', 'added_at', 'last_updated', 'registered',
+        'session_string', 'registration_step', 'registration_phone', 'phone_code_hash',
+        'temp_session', 'username', 'first_name', 'last_name'
+    )
+    _DATETIME_FIELDS = ('added_at', 'last_updated')
+
     def to_dict(self):
         """Convert model to dictionary"""
-        return {
-            'user_id': self.user_id,
-            'api_id': self.api_id,
-            'api_hash': self.api_hash,
-            'added_at': self.added_at.isoformat() if self.added_at else None,
-            'last_updated': self.last_updated.isoformat() if self.last_updated else None,
-            'registered': self.registered,
-            'session_string': self.session_string,
-            'registration_step': self.registration_step,
-            'registration_phone': self.registration_phone,
-            'phone_code_hash': self.phone_code_hash,
-            'temp_session': self.temp_session,
-            'username': self.username,
-            'first_name': self.first_name,
-            'last_name': self.last_name,
-            'metadata': self.user_metadata or {}  # Keep the dict key as metadata for compatibility
-        }
+        data = {name: getattr(self, name) for name in self._DICT_FIELDS}
+        for name in self._DATETIME_FIELDS:
+            value = data[name]
+            data[name] = value.isoformat() if value else None
+        data['metadata'] = self.user_metadata or {}  # Keep the dict key as metadata for compatibility
+        return data
 
     @classmethod
-    def from_dict(cls, data: dict):
-        """Create model from dictionary"""
+    def columns_from_dict(cls, data: dict) -> dict:
+        """Map a to_dict-style dictionary to column values"""
+        data = dict(data)
         # Convert metadata to user_metadata for the model
         if 'metadata' in data:
             data['user_metadata'] = data.pop('metadata')
-            
-        if 'added_at' in data and isinstance(data['added_at'], str):
-            data['added_at'] = datetime.fromisoformat(data['added_at'])
-        if 'last_updated' in data and isinstance(data['last_updated'], str):
-            data['last_updated'] = datetime.fromisoformat(data['last_updated'])
-        return cls(**data) 
\ No newline at end of file
+        
+        for name in cls._DATETIME_FIELDS:
+            value = data.get(name)
+            if isinstance(value, str):
+                data[name] = datetime.fromisoformat(value)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Create model from dictionary"""
+        return cls(**cls.columns_from_dict(data))
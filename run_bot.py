@@ -2,29 +2,25 @@ import asyncio
 import sys
 import signal
 from datetime import datetime
-from control.bot import control_bot
 from utils.logger import logger
 
-# Flags to track shutdown state
-_shutdown_requested = False
 _cleanup_timeout = 10  # seconds
 
-def handle_signal(signum, frame):
+def handle_signal(stop: asyncio.Future, sig: signal.Signals):
     """Handle termination signals"""
-    global _shutdown_requested
-    signame = signal.Signals(signum).name
-    
-    if _shutdown_requested:
-        logger.warning(f"\nReceived second signal {signame}, immediate exit...")
+    if stop.done():
+        logger.warning(f"\nReceived second signal {sig.name}, immediate exit...")
         sys.stdout.flush()
         sys.exit(1)
-    else:
-        logger.info(f"\nReceived signal {signame}, starting graceful shutdown...")
-        _shutdown_requested = True
+    
+    logger.info(f"\nReceived signal {sig.name}, starting graceful shutdown...")
+    stop.set_result(None)
     sys.stdout.flush()
 
 async def cleanup():
     """Perform cleanup when the bot is stopping"""
+    from control.bot import control_bot
+    
     try:
         logger.info("Initiating graceful shutdown...")
         sys.stdout.flush()
@@ -47,22 +43,28 @@ async def cleanup():
 
 async def main():
     """Main entry point"""
-    global _shutdown_requested
+    loop = asyncio.get_running_loop()
+    stop = loop.create_future()
     
     # Set up signal handlers for graceful shutdown
-    signal.signal(signal.SIGTERM, handle_signal)
-    signal.signal(signal.SIGINT, handle_signal)
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, handle_signal, stop, sig)
+        except NotImplementedError:
+            pass  # No loop signal support on Windows; KeyboardInterrupt still applies
     
     try:
         logger.info("=== Starting ControlBot ===")
         sys.stdout.flush()
         
-        # Start the bot
-        await control_bot.start()
+        # Import the bot (and Telethon with it) only once we are about to run it
+        from control.bot import control_bot
         
-        # Keep running until shutdown is requested
-        while not _shutdown_requested:
-            await asyncio.sleep(1)
+        # Start the bot and keep running until it disconnects or shutdown is requested
+        bot_task = asyncio.create_task(control_bot.start())
+        await asyncio.wait((bot_task, stop), return_when=asyncio.FIRST_COMPLETED)
+        if bot_task.done():
+            bot_task.result()  # Surface errors raised by the bot
         
         # Perform cleanup
         await cleanup()
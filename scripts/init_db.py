@@ -18,8 +18,7 @@ def main():
         logger.info("Database tables created successfully")
         
         # Migrate existing whitelist data from Redis to PostgreSQL if any exists
-        redis_data = db_manager.get_cache('controlbot:whitelist')
-        if redis_data:
+        if db_manager.redis.exists('controlbot:whitelist'):
             logger.info("Found existing whitelist data in Redis, migrating to PostgreSQL...")
             from utils.whitelist import whitelist_manager
             whitelist_manager._save_whitelist()  # This will save to both PostgreSQL and Redis
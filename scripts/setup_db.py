@@ -1,23 +1,30 @@
 import os
+import re
 import sys
 import subprocess
 import getpass
 
-def run_psql_command(command, as_postgres=True, ignore_errors=False):
-    """Run a PostgreSQL command"""
+DATABASE_URL_LINE = re.compile(r'^DATABASE_URL=.*$', re.MULTILINE)
+
+def run_psql_script(script, as_postgres=True):
+    """Run a batch of PostgreSQL statements in a single psql session"""
     user = 'postgres' if as_postgres else 'arkanisbot'
     try:
-        process = subprocess.Popen(
-            ['psql', '-U', user, '-c', command],
+        # Statements are fed on stdin so each runs in its own transaction
+        # (CREATE DATABASE cannot run inside one) and psql keeps going after an error
+        result = subprocess.run(
+            ['psql', '-U', user, '-v', 'ON_ERROR_STOP=0', '-f', '-'],
+            input=script.encode(),
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE
         )
-        stdout, stderr = process.communicate()
-        if process.returncode != 0 and not ignore_errors:
-            error_msg = stderr.decode() if hasattr(stderr, 'decode') else stderr
-            if "already exists" not in error_msg or not ignore_errors:
-                print("Error executing command:", error_msg)
-                return False
+        errors = [
+            line for line in result.stderr.decode().splitlines()
+            if line.strip() and "already exists" not in line
+        ]
+        if errors:
+            print("Error executing command:", '\n'.join(errors))
+            return False
         return True
     except Exception as e:
         print("Failed to execute command:", str(e))
@@ -26,18 +33,14 @@ def run_psql_command(command, as_postgres=True, ignore_errors=False):
 def main():
     """Set up PostgreSQL database and user"""
     try:
-        # Create database user (ignore if already exists)
         password = getpass.getpass("Enter password for database user 'arkanisbot': ")
-        create_user = "CREATE USER arkanisbot WITH PASSWORD '{0}';".format(password)
-        run_psql_command(create_user, ignore_errors=True)
-
-        # Create database (ignore if already exists)
-        create_db = "CREATE DATABASE arkanisbot OWNER arkanisbot;"
-        run_psql_command(create_db, ignore_errors=True)
-
-        # Grant privileges
-        grant_privileges = "GRANT ALL PRIVILEGES ON DATABASE arkanisbot TO arkanisbot;"
-        run_psql_command(grant_privileges)
+        # Create user and database (ignored if they already exist), then grant privileges
+        setup_sql = (
+            "CREATE USER arkanisbot WITH PASSWORD '{0}';\n"
+            "CREATE DATABASE arkanisbot OWNER arkanisbot;\n"
+            "GRANT ALL PRIVILEGES ON DATABASE arkanisbot TO arkanisbot;\n"
+        ).format(password)
+        run_psql_script(setup_sql)
 
         # Update .env file
         env_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env')
@@ -50,17 +53,11 @@ def main():
                 env_content = f.read()
 
         # Update DATABASE_URL if it exists, otherwise append it
-        if 'DATABASE_URL=' in env_content:
-            lines = env_content.splitlines()
-            new_lines = []
-            for line in lines:
-                if line.startswith('DATABASE_URL='):
-                    new_lines.append('DATABASE_URL="{0}"'.format(db_url))
-                else:
-                    new_lines.append(line)
-            env_content = '\n'.join(new_lines)
-        else:
-            env_content += '\nDATABASE_URL="{0}"'.format(db_url)
+        db_line = 'DATABASE_URL="{0}"'.format(db_url)
+        # Replacement is a function so backslashes in the password are kept literally
+        env_content, replaced = DATABASE_URL_LINE.subn(lambda _: db_line, env_content)
+        if not replaced:
+            env_content += '\n' + db_line
 
         # Write updated .env file
         with open(env_path, 'w') as f:
@@ -1,4 +1,6 @@
 from telethon import TelegramClient, events
+from telethon.network import ConnectionTcpAbridged
+from telethon.sessions import StringSession
 from telethon.tl.functions.messages import GetDialogsRequest
 from telethon.tl.functions.channels import JoinChannelRequest, LeaveChannelRequest
 from telethon.tl.functions.messages import ImportChatInviteRequest
@@ -13,17 +15,84 @@ from typing import List, Dict, Optional, Union
 from datetime import datetime
 import json
 import os
+import orjson
 from utils.logger import logger
 from utils.database import db_manager
 
+# Clients shared by every UserBot driving the same session: session_id -> client,
+# with the number of UserBots holding each one
+_client_pool: Dict[str, TelegramClient] = {}
+_client_refs: Dict[str, int] = {}
+
+def get_client(session_id: str, session_string: str, api_id: int, api_hash: str) -> TelegramClient:
+    """Return the pooled client for a session, creating it on first use; pair with release_client"""
+    _client_refs[session_id] = _client_refs.get(session_id, 0) + 1
+    client = _client_pool.get(session_id)
+    if client is None:
+        client = TelegramClient(
+            StringSession(session_string),
+            api_id,
+            api_hash,
+            connection=ConnectionTcpAbridged,  # Smallest per-packet framing overhead
+            connection_retries=5,
+            auto_reconnect=True,
+            flood_sleep_threshold=60,
+            use_ipv6=False,
+            sequential_updates=True,  # One update worker instead of a task per update
+            device_model="ArkanisUserBot",
+            system_version="1.0",
+            app_version="1.0"
+        )
+        _client_pool[session_id] = client
+    return client
+
+def release_client(session_id: str) -> bool:
+    """Drop one reference to a pooled client; True once the last holder released it"""
+    refs = _client_refs.get(session_id, 0) - 1
+    if refs > 0:
+        _client_refs[session_id] = refs
+        return False
+    _client_refs.pop(session_id, None)
+    _client_pool.pop(session_id, None)
+    return True
+
+async def acquire_client(session_id: str, session_string: str, api_id: int, api_hash: str) -> TelegramClient:
+    """Connected pooled client for a session; hand it back with drop_client"""
+    client = get_client(session_id, session_string, api_id, api_hash)
+    try:
+        if not client.is_connected():
+            await client.connect()
+    except BaseException:
+        await drop_client(session_id, client)
+        raise
+    return client
+
+async def drop_client(session_id: str, client: TelegramClient):
+    """Release a client from acquire_client, disconnecting it once no one holds it"""
+    if release_client(session_id) and client.is_connected():
+        await client.disconnect()
+
 class UserBot:
-    def __init__(self, session_id: str, client: TelegramClient):
+    ACTION_QUEUE_SIZE = 1000  # queue_action waits once this many actions are pending
+    WORKER_COUNT = int(os.getenv('UBOT_WORKERS', '4'))
+    CHAT_LOCK_STRIPES = 64
+    DIALOGS_CACHE_TTL = 30  # seconds
+    
+    def __init__(self, session_id: str, client: TelegramClient, pooled: bool = False):
         self.session_id = session_id
         self.client = client
+        self.pooled = pooled  # Client came from get_client and is shared with other UserBots
         self.active = False
         self.last_action = datetime.utcnow()
-        self.action_queue = asyncio.Queue()
+        self.action_queue = asyncio.Queue(maxsize=self.ACTION_QUEUE_SIZE)
         self.running_tasks: List[asyncio.Task] = []
+        # Actions on the same chat run in order; different chats run in parallel
+        self._chat_locks = [asyncio.Lock() for _ in range(self.CHAT_LOCK_STRIPES)]
+    
+    @classmethod
+    def for_session(cls, session_id: str, session_string: str, api_id: int, api_hash: str) -> 'UserBot':
+        """Create a UserBot on the session's pooled client"""
+        return cls(session_id, get_client(session_id, session_string, api_id, api_hash), pooled=True)
     
     async def start(self):
         """Start the UserBot"""
@@ -34,9 +103,10 @@ class UserBot:
             self.active = True
             logger.info(f"UserBot {self.session_id} started")
             
-            # Start action processor
-            self.running_tasks.append(
+            # Start action processors
+            self.running_tasks.extend(
                 asyncio.create_task(self._process_actions())
+                for _ in range(self.WORKER_COUNT)
             )
             
         except Exception as e:
@@ -56,8 +126,13 @@ class UserBot:
             # Wait for tasks to complete
             await asyncio.gather(*self.running_tasks, return_exceptions=True)
             
-            # Disconnect client
-            if self.client.is_connected():
+            # Disconnect the client unless other UserBots still share it
+            if self.pooled:
+                self.pooled = False  # Release our reference only once
+                last = release_client(self.session_id)
+            else:
+                last = True
+            if last and self.client.is_connected():
                 await self.client.disconnect()
             
             logger.info(f"UserBot {self.session_id} stopped")
@@ -71,26 +146,32 @@ class UserBot:
         while self.active:
             try:
                 action = await self.action_queue.get()
+            except asyncio.CancelledError:
+                break
+            
+            try:
                 self.last_action = datetime.utcnow()
                 
                 action_type = action['type']
                 params = action['params']
                 
-                if action_type == 'join_chat':
-                    await self._join_chat(**params)
-                elif action_type == 'leave_chat':
-                    await self._leave_chat(**params)
-                elif action_type == 'send_message':
-                    await self._send_message(**params)
-                elif action_type == 'forward_message':
-                    await self._forward_message(**params)
-                
-                self.action_queue.task_done()
+                chat = params.get('to_chat', params.get('chat_id'))
+                async with self._chat_locks[hash(chat) % self.CHAT_LOCK_STRIPES]:
+                    if action_type == 'join_chat':
+                        await self._join_chat(**params)
+                    elif action_type == 'leave_chat':
+                        await self._leave_chat(**params)
+                    elif action_type == 'send_message':
+                        await self._send_message(**params)
+                    elif action_type == 'forward_message':
+                        await self._forward_message(**params)
                 
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.error(f"Error processing action for {self.session_id}: {e}")
+            finally:
+                self.action_queue.task_done()
     
     async def queue_action(self, action_type: str, **params):
         """Queue an action for processing"""
@@ -173,6 +254,14 @@ class UserBot:
     
     async def get_dialogs(self, limit: int = 100) -> List[Dict]:
         """Get user's dialogs (chats and channels)"""
+        cache_key = f"dialogs:{self.session_id}:{limit}"
+        try:
+            cached = await db_manager.aget_cache(cache_key)
+            if cached:
+                return orjson.loads(cached)
+        except Exception as e:
+            logger.warning(f"Failed to read cached dialogs for {self.session_id}: {e}")
+        
         try:
             dialogs = []
             async for dialog in self.client.iter_dialogs(limit=limit):
@@ -196,6 +285,10 @@ class UserBot:
                 
                 dialogs.append(dialog_info)
             
+            try:
+                await db_manager.aset_cache(cache_key, orjson.dumps(dialogs).decode(), expire=self.DIALOGS_CACHE_TTL)
+            except Exception as e:
+                logger.warning(f"Failed to cache dialogs for {self.session_id}: {e}")
             return dialogs
             
         except Exception as e:
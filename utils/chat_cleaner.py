@@ -1,10 +1,13 @@
 from __future__ import annotations
 from dataclasses import dataclass, field
-from datetime import datetime, timezone, timedelta
+from datetime import timedelta
 from enum import Enum, auto
-from typing import Dict, Set, Optional, List, Any, Callable, Awaitable
+from typing import AbstractSet, Dict, Set, Optional, List, Any, Callable, Awaitable, Tuple
 import asyncio
-import weakref
+import heapq
+import time
+import orjson
+from itertools import islice
 from telethon import TelegramClient
 from telethon.errors import (
     MessageDeleteForbiddenError,
@@ -12,6 +15,7 @@ from telethon.errors import (
     FloodWaitError
 )
 from telethon.tl.custom import Message
+from redis.exceptions import ResponseError
 from utils.logger import logger
 from utils.redis_config import redis_manager
 from functools import wraps
@@ -28,14 +32,16 @@ class MessageContext(Enum):
     SYSTEM = auto()  # System messages that should persist
     TEMP = auto()  # Temporary messages to be cleaned up
 
-@dataclass
+# Contexts cleared by with_cleanup before every handler
+CLEANUP_CONTEXTS = frozenset({MessageContext.MENU, MessageContext.COMMAND, MessageContext.TEMP})
+
+@dataclass(slots=True)
 class MessageTracker:
     """Tracks message state and context for a user session"""
     message_id: int
     context: MessageContext
     chat_id: int
-    timestamp: float = field(default_factory=lambda: datetime.now(timezone.utc).timestamp())
-    weak_ref: Optional[weakref.ref] = None
+    timestamp: float = field(default_factory=time.time)  # Wall clock: persisted across restarts
     metadata: Dict[str, Any] = field(default_factory=dict)
     
     def to_dict(self) -> dict:
@@ -83,7 +89,7 @@ def with_cleanup(func: Callable) -> Callable:
                 event.client,
                 user_id,
                 chat_id,
-                context_filter={MessageContext.MENU, MessageContext.COMMAND, MessageContext.TEMP}
+                context_filter=CLEANUP_CONTEXTS
             )
             
             # Execute handler
@@ -109,12 +115,13 @@ class ChatCleaner:
     def __init__(self, debug_mode: bool = False):
         # Core state tracking
         self._messages: Dict[int, Dict[int, MessageTracker]] = {}  # user_id -> {msg_id -> tracker}
+        self._by_context: Dict[int, Dict[MessageContext, Set[int]]] = {}  # user_id -> {context -> msg_ids}
         self._current_menu: Dict[int, int] = {}  # user_id -> current_menu_id
         self._auth_state: Dict[int, bool] = {}  # user_id -> is_in_auth
         
         # Activity tracking
         self._last_activity: Dict[int, float] = {}
-        self._cleanup_locks: Dict[int, asyncio.Lock] = {}
+        self._cleanup_locks: List[asyncio.Lock] = [asyncio.Lock() for _ in range(64)]  # Striped by user_id
         self._state_lock = asyncio.Lock()
         
         # Configuration
@@ -123,12 +130,26 @@ class ChatCleaner:
         self.CLEANUP_INTERVAL = 300  # 5 minutes
         self.MAX_TRACKED_MESSAGES = 100  # Per user
         self.DELETION_BATCH_SIZE = 50
+        self.DELETION_CONCURRENCY = 4  # Batches deleted in parallel
         self.LOCK_TIMEOUT = 3.0  # seconds
+        self.FLUSH_INTERVAL = 0.2  # seconds between batched Redis writes
+        self.FLUSH_BATCH_SIZE = 100  # Flush early once this many users are dirty
         
         # Async state
         self._cleanup_task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
         self._is_running = False
         
+        # Tracker changes not yet written to Redis: user_id -> {msg_id -> tracker, or None if deleted}
+        self._pending_writes: Dict[int, Dict[int, Optional[MessageTracker]]] = {}
+        # Current menu id last written to Redis per user
+        self._saved_menu: Dict[int, Optional[int]] = {}
+        # Users whose stored trackers are being merged in by a background load
+        self._loading_users: Set[int] = set()
+        self._flush_wakeup = asyncio.Event()
+        # Strong references so fire-and-forget tasks are not garbage collected mid-run
+        self._background_tasks: Set[asyncio.Task] = set()
+        
         # Optional callback for persistent storage
         self._persistence_callback: Optional[Callable[[int, Dict[int, MessageTracker]], Awaitable[None]]] = None
         
@@ -150,52 +171,174 @@ class ChatCleaner:
         """Get Redis key for user's tracked messages"""
         return f"{REDIS_KEY_PREFIX}{user_id}"
 
+    def _get_menu_key(self, user_id: int) -> str:
+        """Get Redis key for user's current menu message id"""
+        return f"{REDIS_KEY_PREFIX}{user_id}:menu"
+
+    def _add_tracker(self, user_id: int, tracker: MessageTracker) -> None:
+        """Store a tracker and index it by context, replacing any tracker for the same message"""
+        self._remove_tracker(user_id, tracker.message_id)
+        self._messages.setdefault(user_id, {})[tracker.message_id] = tracker
+        self._by_context.setdefault(user_id, {}).setdefault(tracker.context, set()).add(tracker.message_id)
+
+    def _remove_tracker(self, user_id: int, msg_id: int) -> Optional[MessageTracker]:
+        """Drop a tracker and its context index entry, returning it if it existed"""
+        tracker = self._messages.get(user_id, {}).pop(msg_id, None)
+        if tracker is not None:
+            self._by_context[user_id][tracker.context].discard(msg_id)
+        return tracker
+
     async def _load_from_redis(self, user_id: int) -> None:
         """Load tracked messages from Redis"""
-        if not redis_manager.enabled:
+        stored = await self._fetch_from_redis(user_id)
+        if stored is None:
             return
         
+        trackers, current_menu = stored
+        if trackers:
+            self._messages[user_id] = {}
+            self._by_context[user_id] = {}
+            for tracker in trackers.values():
+                self._add_tracker(user_id, tracker)
+            logger.info(f"Loaded {len(trackers)} tracked messages from Redis for user {user_id}")
+        if current_menu is not None:
+            self._current_menu[user_id] = current_menu
+
+    async def _merge_from_redis(self, user_id: int) -> None:
+        """Background load that merges stored trackers under the ones tracked meanwhile"""
         try:
-            data = await redis_manager.get_json(self._get_redis_key(user_id))
-            if data:
-                trackers = {
-                    msg_data['message_id']: MessageTracker.from_dict(msg_data)
-                    for msg_data in data['messages']
-                }
-                self._messages[user_id] = trackers
-                if 'current_menu' in data:
-                    self._current_menu[user_id] = data['current_menu']
-                logger.info(f"Loaded {len(trackers)} tracked messages from Redis for user {user_id}")
+            stored = await self._fetch_from_redis(user_id)
+            if stored is None:
+                return
+            
+            trackers, current_menu = stored
+            async with self._state_lock:
+                tracked = self._messages.get(user_id)
+                if tracked is None:
+                    return  # User data was cleared while loading
+                for msg_id, tracker in trackers.items():
+                    if msg_id not in tracked:
+                        self._add_tracker(user_id, tracker)
+                if current_menu is not None:
+                    self._current_menu.setdefault(user_id, current_menu)
+            if trackers:
+                logger.info(f"Merged {len(trackers)} tracked messages from Redis for user {user_id}")
+        finally:
+            self._loading_users.discard(user_id)
+
+    async def _fetch_from_redis(self, user_id: int) -> Optional[Tuple[Dict[int, MessageTracker], Optional[int]]]:
+        """Read a user's stored trackers and current menu id from Redis"""
+        pipe = redis_manager.pipeline()
+        if pipe is None:
+            return None
+        
+        key = self._get_redis_key(user_id)
+        try:
+            async with pipe:
+                pipe.hgetall(key)
+                pipe.get(self._get_menu_key(user_id))
+                fields, current_menu = await pipe.execute(raise_on_error=False)
+            
+            if isinstance(fields, ResponseError):
+                # Older releases stored the whole state as one JSON string under this key
+                await redis_manager.delete(key)
+                logger.info(f"Dropped legacy tracked message state for user {user_id}")
+                fields = {}
+            elif isinstance(fields, Exception):
+                raise fields
+            
+            trackers = {}
+            for raw in fields.values():
+                tracker = MessageTracker.from_dict(orjson.loads(raw))
+                trackers[tracker.message_id] = tracker
+            menu_id = int(current_menu) if current_menu and not isinstance(current_menu, Exception) else None
+            return trackers, menu_id
         except Exception as e:
             logger.error(f"Error loading messages from Redis for user {user_id}: {str(e)}")
+            return None
 
-    async def _save_to_redis(self, user_id: int) -> None:
-        """Save tracked messages to Redis"""
+    def _queue_write(self, user_id: int, changes: Dict[int, Optional[MessageTracker]]) -> None:
+        """Queue tracker changes for the next batched Redis write (None deletes the field)"""
         if not redis_manager.enabled:
             return
         
+        self._pending_writes.setdefault(user_id, {}).update(changes)
+        if len(self._pending_writes) >= self.FLUSH_BATCH_SIZE:
+            self._flush_wakeup.set()
+
+    async def _flush_to_redis(self) -> None:
+        """Apply pending tracker changes of all users to Redis in one pipeline"""
+        if not self._pending_writes:
+            return
+        pipe = redis_manager.pipeline()
+        if pipe is None:
+            return
+        
+        pending, self._pending_writes = self._pending_writes, {}
+        menus = {user_id: self._current_menu.get(user_id) for user_id in pending}
         try:
-            data = {
-                'messages': [
-                    tracker.to_dict()
-                    for tracker in self._messages.get(user_id, {}).values()
-                ],
-                'current_menu': self._current_menu.get(user_id)
-            }
-            await redis_manager.set_json(
-                self._get_redis_key(user_id),
-                data,
-                ex=REDIS_MESSAGE_EXPIRY
-            )
-            logger.debug(f"Saved {len(data['messages'])} messages to Redis for user {user_id}")
+            async with pipe:
+                for user_id, changes in pending.items():
+                    key = self._get_redis_key(user_id)
+                    updated = {
+                        msg_id: orjson.dumps(tracker.to_dict(), option=orjson.OPT_NON_STR_KEYS)
+                        for msg_id, tracker in changes.items() if tracker is not None
+                    }
+                    removed = [msg_id for msg_id, tracker in changes.items() if tracker is None]
+                    if updated:
+                        pipe.hset(key, mapping=updated)
+                    if removed:
+                        pipe.hdel(key, *removed)
+                    pipe.expire(key, REDIS_MESSAGE_EXPIRY)
+                    
+                    # Rewrite the menu key only if it changed since the last save
+                    current_menu = menus[user_id]
+                    menu_key = self._get_menu_key(user_id)
+                    if user_id in self._saved_menu and self._saved_menu[user_id] == current_menu:
+                        if current_menu is not None:
+                            pipe.expire(menu_key, REDIS_MESSAGE_EXPIRY)
+                    elif current_menu is None:
+                        pipe.delete(menu_key)
+                    else:
+                        pipe.set(menu_key, current_menu, ex=REDIS_MESSAGE_EXPIRY)
+                await pipe.execute()
+            self._saved_menu.update(menus)
+            logger.debug(f"Saved tracked message changes to Redis for {len(pending)} users")
         except Exception as e:
-            logger.error(f"Error saving messages to Redis for user {user_id}: {str(e)}")
+            logger.error(f"Error saving tracked messages to Redis: {str(e)}")
+            # Retry on the next flush, letting changes queued meanwhile win
+            for user_id, changes in pending.items():
+                if user_id in self._messages:
+                    self._pending_writes[user_id] = {**changes, **self._pending_writes.get(user_id, {})}
+
+    async def _periodic_flush(self) -> None:
+        """Write pending changes to Redis every FLUSH_INTERVAL or once enough users have piled up"""
+        while self._is_running:
+            try:
+                try:
+                    await asyncio.wait_for(self._flush_wakeup.wait(), timeout=self.FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._flush_wakeup.clear()
+                await self._flush_to_redis()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error in periodic Redis flush: {str(e)}")
+
+    def _spawn(self, coro) -> asyncio.Task:
+        """Run a coroutine in the background, keeping it referenced until it finishes"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
 
     async def start(self) -> None:
         """Start the chat cleaner service"""
         if not self._is_running:
             self._is_running = True
             self._cleanup_task = asyncio.create_task(self._periodic_cleanup())
+            self._flush_task = asyncio.create_task(self._periodic_flush())
             logger.info("Started chat cleaner service")
 
     async def shutdown(self) -> None:
@@ -208,11 +351,17 @@ class ChatCleaner:
             except asyncio.CancelledError:
                 pass
             self._cleanup_task = None
-            
-            # Save all tracked messages to Redis before shutdown
-            if redis_manager.enabled:
-                for user_id in self._messages.keys():
-                    await self._save_to_redis(user_id)
+        
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        
+        # Save pending tracker changes to Redis before shutdown
+        await self._flush_to_redis()
             
         logger.info("Chat cleaner service shutdown complete")
 
@@ -224,29 +373,30 @@ class ChatCleaner:
         metadata: Optional[Dict[str, Any]] = None
     ) -> None:
         """Track a new message with its context"""
+        now = time.time()
+        redis_on = redis_manager.enabled
         try:
             async with self._state_lock:
-                # Load existing messages from Redis if this is first message for user
-                if user_id not in self._messages and redis_manager.enabled:
-                    await self._load_from_redis(user_id)
-                
-                # Initialize user tracking if needed
+                # Initialize user tracking if needed; stored messages are merged in the
+                # background so the first message does not wait on a Redis round trip
                 if user_id not in self._messages:
                     self._messages[user_id] = {}
-                    self._last_activity[user_id] = datetime.now(timezone.utc).timestamp()
+                    if redis_on and user_id not in self._loading_users:
+                        self._loading_users.add(user_id)
+                        self._spawn(self._merge_from_redis(user_id))
 
                 # Create message tracker
                 tracker = MessageTracker(
                     message_id=message.id,
                     context=context,
                     chat_id=message.chat_id,
-                    weak_ref=weakref.ref(message),
+                    timestamp=now,
                     metadata=metadata or {}
                 )
                 
                 # Update tracking
-                self._messages[user_id][message.id] = tracker
-                self._last_activity[user_id] = tracker.timestamp
+                self._add_tracker(user_id, tracker)
+                self._last_activity[user_id] = now
 
                 # Handle special contexts
                 if context == MessageContext.MENU:
@@ -254,7 +404,7 @@ class ChatCleaner:
                     self._current_menu[user_id] = message.id
                     if old_menu:
                         # Clean previous menu asynchronously
-                        asyncio.create_task(self.clean_messages(
+                        self._spawn(self.clean_messages(
                             message.client, 
                             user_id,
                             message.chat_id,
@@ -263,7 +413,7 @@ class ChatCleaner:
                 
                 elif context == MessageContext.COMMAND:
                     # Schedule command message for deletion after short delay
-                    asyncio.create_task(self._delayed_command_cleanup(
+                    self._spawn(self._delayed_command_cleanup(
                         message.client,
                         user_id,
                         message.chat_id,
@@ -274,9 +424,10 @@ class ChatCleaner:
                 if len(self._messages[user_id]) > self.MAX_TRACKED_MESSAGES:
                     await self._prune_old_messages(user_id)
 
-                # Save to Redis
-                if redis_manager.enabled:
-                    await self._save_to_redis(user_id)
+                # Save to Redis with the next batch; commands are deleted within seconds,
+                # so they are only tracked in memory
+                if redis_on and context is not MessageContext.COMMAND:
+                    self._queue_write(user_id, {message.id: tracker})
 
                 # Persist state if callback is set
                 if self._persistence_callback:
@@ -307,7 +458,7 @@ class ChatCleaner:
         client: TelegramClient,
         user_id: int,
         chat_id: int,
-        context_filter: Optional[Set[MessageContext]] = None,
+        context_filter: Optional[AbstractSet[MessageContext]] = None,
         message_ids: Optional[Set[int]] = None,
         exclude_current_menu: bool = True
     ) -> None:
@@ -318,7 +469,7 @@ class ChatCleaner:
                 await self._load_from_redis(user_id)
             
             # Try to acquire cleanup lock with timeout
-            lock = self._cleanup_locks.setdefault(user_id, asyncio.Lock())
+            lock = self._cleanup_locks[user_id % len(self._cleanup_locks)]
             try:
                 async with asyncio.timeout(self.LOCK_TIMEOUT):
                     async with lock:
@@ -342,7 +493,7 @@ class ChatCleaner:
         client: TelegramClient,
         user_id: int,
         chat_id: int,
-        context_filter: Optional[Set[MessageContext]],
+        context_filter: Optional[AbstractSet[MessageContext]],
         message_ids: Optional[Set[int]],
         exclude_current_menu: bool
     ) -> None:
@@ -359,12 +510,10 @@ class ChatCleaner:
             if message_ids:
                 to_delete.update(message_ids)
             
-            if context_filter and user_id in self._messages:
-                filtered_msgs = {
-                    msg_id for msg_id, tracker in self._messages[user_id].items()
-                    if tracker.context in context_filter
-                }
-                to_delete.update(filtered_msgs)
+            if context_filter and user_id in self._by_context:
+                by_context = self._by_context[user_id]
+                for context in context_filter:
+                    to_delete.update(by_context.get(context, ()))
             
             # Remove current menu from deletion set if needed
             if current_menu and current_menu in to_delete:
@@ -373,31 +522,58 @@ class ChatCleaner:
             if not to_delete:
                 return
 
-            # Delete messages in batches
-            for batch in [list(to_delete)[i:i + self.DELETION_BATCH_SIZE] 
-                         for i in range(0, len(to_delete), self.DELETION_BATCH_SIZE)]:
+            # Delete messages in batches, a few requests in flight at a time
+            semaphore = asyncio.Semaphore(self.DELETION_CONCURRENCY)
+            ids = iter(to_delete)
+            batches = list(iter(lambda: list(islice(ids, self.DELETION_BATCH_SIZE)), []))
+            results = await asyncio.gather(*(
+                self._delete_batch(client, user_id, chat_id, batch, semaphore)
+                for batch in batches
+            ))
+            deleted = [msg_id for batch, ok in zip(batches, results) if ok for msg_id in batch]
+            if not deleted:
+                return
+            
+            # Clean up tracking for deleted messages; the per-user cleanup lock already
+            # owns this user's trackers, so other users' cleanups are not held up
+            stored = [
+                msg_id for msg_id in deleted
+                if getattr(self._remove_tracker(user_id, msg_id), 'context', None) is not MessageContext.COMMAND
+            ]
+            # Drop the deleted messages from Redis with the next batch
+            if stored:
+                self._queue_write(user_id, dict.fromkeys(stored))
+
+        except Exception as e:
+            logger.error(f"Error in _do_clean_messages: {str(e)}", exc_info=True)
+
+    async def _delete_batch(
+        self,
+        client: TelegramClient,
+        user_id: int,
+        chat_id: int,
+        batch: List[int],
+        semaphore: asyncio.Semaphore
+    ) -> bool:
+        """Delete one batch of messages, retrying once after a FloodWait"""
+        async with semaphore:
+            for _ in range(2):
                 try:
                     await client.delete_messages(chat_id, batch)
-                    # Clean up tracking for deleted messages
-                    async with self._state_lock:
-                        for msg_id in batch:
-                            if user_id in self._messages and msg_id in self._messages[user_id]:
-                                del self._messages[user_id][msg_id]
-                        # Update Redis after batch deletion
-                        if redis_manager.enabled:
-                            await self._save_to_redis(user_id)
+                    return True
                 except MessageDeleteForbiddenError:
                     logger.warning(f"Delete forbidden for some messages in user {user_id}")
+                    return False
                 except MessageIdInvalidError:
                     logger.warning(f"Invalid message IDs for user {user_id}")
+                    return False
                 except FloodWaitError as e:
                     logger.warning(f"FloodWait for {e.seconds}s when deleting messages")
                     await asyncio.sleep(e.seconds)
                 except Exception as e:
                     logger.error(f"Error deleting message batch: {str(e)}")
-
-        except Exception as e:
-            logger.error(f"Error in _do_clean_messages: {str(e)}", exc_info=True)
+                    return False
+            return False
 
     async def _periodic_cleanup(self) -> None:
         """Periodic cleanup of inactive users and old messages"""
@@ -413,48 +589,49 @@ class ChatCleaner:
     async def _cleanup_inactive_users(self) -> None:
         """Clean up data for inactive users"""
         try:
-            current_time = datetime.now(timezone.utc).timestamp()
+            current_time = time.time()
             inactive_threshold = current_time - self.INACTIVE_THRESHOLD.total_seconds()
             
-            async with self._state_lock:
-                inactive_users = [
-                    user_id for user_id, last_time in self._last_activity.items()
-                    if last_time < inactive_threshold
-                ]
-                
-                for user_id in inactive_users:
-                    await self.clear_user_data(user_id)
+            inactive_users = [
+                user_id for user_id, last_time in self._last_activity.items()
+                if last_time < inactive_threshold
+            ]
+            
+            # clear_user_data takes the state lock itself
+            for user_id in inactive_users:
+                await self.clear_user_data(user_id)
                     
         except Exception as e:
             logger.error(f"Error cleaning inactive users: {str(e)}")
 
     async def _prune_old_messages(self, user_id: int) -> None:
         """Remove oldest tracked messages when limit is exceeded"""
-        if user_id in self._messages:
-            sorted_msgs = sorted(
-                self._messages[user_id].items(),
-                key=lambda x: x[1].timestamp
-            )
-            to_remove = len(sorted_msgs) - self.MAX_TRACKED_MESSAGES
+        tracked = self._messages.get(user_id)
+        if tracked:
+            to_remove = len(tracked) - self.MAX_TRACKED_MESSAGES
             if to_remove > 0:
-                for msg_id, _ in sorted_msgs[:to_remove]:
-                    del self._messages[user_id][msg_id]
+                # Only the oldest few are needed, not a full sort
+                oldest = heapq.nsmallest(to_remove, tracked.items(), key=lambda x: x[1].timestamp)
+                pruned = [msg_id for msg_id, _ in oldest]
+                for msg_id in pruned:
+                    self._remove_tracker(user_id, msg_id)
                 # Update Redis after pruning
-                if redis_manager.enabled:
-                    await self._save_to_redis(user_id)
+                self._queue_write(user_id, dict.fromkeys(pruned))
 
     async def clear_user_data(self, user_id: int) -> None:
         """Clear all tracking data for a user"""
         async with self._state_lock:
             self._messages.pop(user_id, None)
+            self._by_context.pop(user_id, None)
             self._current_menu.pop(user_id, None)
             self._auth_state.pop(user_id, None)
             self._last_activity.pop(user_id, None)
-            self._cleanup_locks.pop(user_id, None)
+            self._pending_writes.pop(user_id, None)
+            self._saved_menu.pop(user_id, None)
             
             # Clear Redis data
             if redis_manager.enabled:
-                await redis_manager.delete(self._get_redis_key(user_id))
+                await redis_manager.delete(self._get_redis_key(user_id), self._get_menu_key(user_id))
 
     def set_auth_state(self, user_id: int, is_auth: bool) -> None:
         """Set authentication state for a user"""
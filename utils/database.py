@@ -1,9 +1,10 @@
 import os
-from typing import Optional
+from typing import Dict, Iterable, List, Optional
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 import redis
+import redis.asyncio as aioredis
 from redis import Redis
 from contextlib import contextmanager
 from dotenv import load_dotenv
@@ -17,22 +18,62 @@ DATABASE_URL = os.getenv('DATABASE_URL')
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
-logger.info(f"Initializing database with URL: {DATABASE_URL}")
-engine = create_engine(DATABASE_URL)
+# Pool sized for many concurrent UserBots sharing the engine
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '20'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '40'))
+
+logger.info(
+    f"Initializing database with URL: {DATABASE_URL} "
+    f"(DB_POOL_SIZE={DB_POOL_SIZE}, DB_MAX_OVERFLOW={DB_MAX_OVERFLOW})"
+)
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,  # Replace connections the server has dropped
+    pool_recycle=1800,  # Recycle before server-side idle timeouts
+    future=True  # 2.0-style engine, so no legacy compatibility paths on SQLAlchemy 1.4
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 # Redis setup
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
+REDIS_POOL_SIZE = int(os.getenv('REDIS_POOL_SIZE', '50'))
 redis_client: Optional[Redis] = None
+async_redis_client: Optional[aioredis.Redis] = None
 
 def get_redis() -> Redis:
     """Get or create Redis connection"""
     global redis_client
     if redis_client is None:
-        redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+        # Bounded pool: callers wait for a free connection instead of opening new ones
+        pool = redis.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=REDIS_POOL_SIZE,
+            timeout=5,
+            decode_responses=True,
+            socket_keepalive=True,
+            health_check_interval=30
+        )
+        redis_client = Redis(connection_pool=pool)
     return redis_client
 
+def get_async_redis() -> aioredis.Redis:
+    """Get or create the asyncio Redis connection used from the event loop"""
+    global async_redis_client
+    if async_redis_client is None:
+        pool = aioredis.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=REDIS_POOL_SIZE,
+            timeout=5,
+            decode_responses=True,
+            socket_keepalive=True,
+            health_check_interval=30
+        )
+        async_redis_client = aioredis.Redis(connection_pool=pool)
+    return async_redis_client
+
 @contextmanager
 def get_db() -> Session:
     """Database session context manager"""
@@ -57,6 +98,11 @@ class DatabaseManager:
         self.redis = get_redis()
         self.engine = engine
     
+    @property
+    def aredis(self) -> aioredis.Redis:
+        """Async Redis client; use this (or the a* cache methods) from coroutines"""
+        return get_async_redis()
+    
     def get_session(self) -> Session:
         """Get a new database session"""
         return SessionLocal()
@@ -82,15 +128,64 @@ class DatabaseManager:
         """Get a value from Redis cache"""
         return self.redis.get(key)
     
+    def set_cache_many(self, mapping: Dict[str, str], expire: int = 3600):
+        """Set several values in Redis cache in one round trip"""
+        # MSET has no expiry option, so pipeline individual SETs instead
+        with self.redis.pipeline(transaction=False) as pipe:
+            for key, value in mapping.items():
+                pipe.set(key, value, ex=expire)
+            pipe.execute()
+    
+    def get_cache_many(self, keys: Iterable[str]) -> List[Optional[str]]:
+        """Get several values from Redis cache, in key order (None for misses)"""
+        keys = list(keys)
+        return self.redis.mget(keys) if keys else []
+    
     def delete_cache(self, key: str):
         """Delete a value from Redis cache"""
         self.redis.delete(key)
     
-    def clear_cache(self, pattern: str = "*"):
+    def clear_cache(self, pattern: str = "*", force: bool = False):
         """Clear all cache entries matching pattern"""
-        keys = self.redis.keys(pattern)
-        if keys:
-            self.redis.delete(*keys)
+        if pattern == "*" and not force:
+            raise ValueError("Refusing to clear the entire cache without force=True")
+        
+        # SCAN walks the keyspace incrementally (KEYS would block the server) and
+        # UNLINK frees memory in the background; deletes are sent in pipelined batches
+        with self.redis.pipeline(transaction=False) as pipe:
+            for count, key in enumerate(self.redis.scan_iter(match=pattern, count=500), 1):
+                pipe.unlink(key)
+                if count % 500 == 0:
+                    pipe.execute()
+            pipe.execute()
+
+    
+    # Async variants for coroutines: the sync client would stall the event loop
+    async def aset_cache(self, key: str, value: str, expire: int = 3600):
+        """Set a value in Redis cache without blocking the event loop"""
+        await self.aredis.set(key, value, ex=expire)
+    
+    async def aget_cache(self, key: str) -> Optional[str]:
+        """Get a value from Redis cache without blocking the event loop"""
+        return await self.aredis.get(key)
+    
+    async def adelete_cache(self, key: str):
+        """Delete a value from Redis cache without blocking the event loop"""
+        await self.aredis.delete(key)
+    
+    async def aclear_cache(self, pattern: str = "*", force: bool = False):
+        """Clear all cache entries matching pattern without blocking the event loop"""
+        if pattern == "*" and not force:
+            raise ValueError("Refusing to clear the entire cache without force=True")
+        
+        async with self.aredis.pipeline(transaction=False) as pipe:
+            count = 0
+            async for key in self.aredis.scan_iter(match=pattern, count=500):
+                pipe.unlink(key)
+                count += 1
+                if count % 500 == 0:
+                    await pipe.execute()
+            await pipe.execute()
 
 # Create a default database manager instance
 db_manager = DatabaseManager() 
\ No newline at end of file
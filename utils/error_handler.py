@@ -1,33 +1,49 @@
+import asyncio
 import functools
+import logging
 import traceback
 import inspect
 import sys
+import time
 from datetime import datetime
 from utils.logger import logger
 
-def get_function_context(func, args, kwargs):
-    """Get detailed information about the function and its arguments"""
-    # Get function details
-    module = inspect.getmodule(func)
-    module_name = module.__name__ if module else "unknown_module"
-    
-    # Get source code information
+# Last rendered timestamp, reused for every error within the same second
+_last_timestamp = (0, "")
+
+def _timestamp() -> str:
+    """Current local time in ISO format at one-second resolution"""
+    global _last_timestamp
+    now = int(time.time())
+    if _last_timestamp[0] != now:
+        _last_timestamp = (now, datetime.fromtimestamp(now).isoformat())
+    return _last_timestamp[1]
+
+@functools.lru_cache(maxsize=1024)
+def _static_context(code):
+    """Source location and parameter names of a code object, inspected once per function"""
     try:
-        source_lines, start_line = inspect.getsourcelines(func)
+        source_lines, start_line = inspect.getsourcelines(code)
         source_code = ''.join(source_lines)
-        file_name = inspect.getfile(func)
+        file_name = inspect.getfile(code)
     except Exception:
         source_code = "Could not retrieve source code"
         start_line = 0
         file_name = "unknown_file"
+    
+    arg_names = code.co_varnames[:code.co_argcount]
+    return file_name, start_line, source_code, arg_names
 
+def get_function_context(func, args, kwargs):
+    """Get detailed information about the function and its arguments"""
+    file_name, start_line, source_code, arg_names = _static_context(func.__code__)
+    
     # Format arguments
-    arg_spec = inspect.getfullargspec(func)
     formatted_args = []
     
     # Handle positional arguments
     for i, arg in enumerate(args):
-        arg_name = arg_spec.args[i] if i < len(arg_spec.args) else f'arg{i}'
+        arg_name = arg_names[i] if i < len(arg_names) else f'arg{i}'
         formatted_args.append(f"{arg_name}={repr(arg)}")
     
     # Handle keyword arguments
@@ -36,7 +52,7 @@ def get_function_context(func, args, kwargs):
     
     return {
         'function_name': func.__name__,
-        'module_name': module_name,
+        'module_name': getattr(func, '__module__', None) or "unknown_module",
         'file_name': file_name,
         'start_line': start_line,
         'source_code': source_code,
@@ -45,7 +61,7 @@ def get_function_context(func, args, kwargs):
 
 def format_error_details(error, context):
     """Format error details into a readable string"""
-    timestamp = datetime.now().isoformat()
+    timestamp = _timestamp()
     error_type = type(error).__name__
     error_msg = str(error)
     
@@ -88,74 +104,83 @@ def format_error_details(error, context):
     
     return '\n'.join(details)
 
+# At most this many error notifications are sent to users at once
+_NOTIFY_SEM = asyncio.Semaphore(8)
+_notify_tasks = set()  # Strong references so pending notifications are not garbage collected
+
+async def _notify_user(event, error_msg):
+    """Best-effort error notification; failures are only logged"""
+    try:
+        async with _NOTIFY_SEM:
+            await event.respond(error_msg)
+    except Exception as notify_error:
+        logger.error(f"Failed to notify user of error: {str(notify_error)}")
+
 def error_handler(func):
     """Decorator that provides detailed error handling and logging."""
+    func_name = func.__name__
+    module_name = getattr(func, '__module__', None) or "unknown_module"
+    
     @functools.wraps(func)
     async def wrapper(*args, **kwargs):
         try:
             return await func(*args, **kwargs)
         except Exception as e:
-            # Get the full traceback
-            exc_type, exc_value, exc_traceback = sys.exc_info()
-            
-            # Get the last frame from the traceback (where the error occurred)
-            tb = traceback.extract_tb(exc_traceback)
-            error_frame = tb[-1]  # Last frame is where the error occurred
+            # Walk to the last traceback entry (where the error occurred); unlike
+            # extract_tb this reads no source lines
+            tb = e.__traceback__
+            while tb.tb_next is not None:
+                tb = tb.tb_next
             
             # Format error location
-            error_location = f"{error_frame.filename}:{error_frame.lineno}"
-            
-            # Get the function context
-            frame = inspect.currentframe()
-            func_name = func.__name__
-            module = inspect.getmodule(func)
-            module_name = module.__name__ if module else "unknown_module"
+            error_location = f"{tb.tb_frame.f_code.co_filename}:{tb.tb_lineno}"
             
-            # Format timestamp
-            timestamp = datetime.now().isoformat()
+            # The detailed report is only built if ERROR messages are being logged
+            if logger.isEnabledFor(logging.ERROR):
+                # Format timestamp
+                timestamp = _timestamp()
             
-            # Build detailed error message
-            error_details = [
-                "🚨 ERROR DETAILS 🚨",
-                "=" * 50,
-                f"Timestamp: {timestamp}",
-                f"Error Type: {type(e).__name__}",
-                f"Error Message: {str(e)}",
-                f"Error Location: {error_location}",
-                "",
-                "FUNCTION CONTEXT",
-                "=" * 50,
-                f"Function: {func_name}",
-                f"Module: {module_name}",
-                "",
-                "TRACEBACK",
-                "=" * 50
-            ]
+                # Build detailed error message
+                error_details = [
+                    "🚨 ERROR DETAILS 🚨",
+                    "=" * 50,
+                    f"Timestamp: {timestamp}",
+                    f"Error Type: {type(e).__name__}",
+                    f"Error Message: {str(e)}",
+                    f"Error Location: {error_location}",
+                    "",
+                    "FUNCTION CONTEXT",
+                    "=" * 50,
+                    f"Function: {func_name}",
+                    f"Module: {module_name}",
+                    "",
+                    "TRACEBACK",
+                    "=" * 50
+                ]
             
-            # Add formatted traceback
-            tb_lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
-            error_details.extend(tb_lines)
+                # Add formatted traceback
+                tb_lines = traceback.format_exception(type(e), e, e.__traceback__)
+                error_details.extend(tb_lines)
             
-            # Log the detailed error
-            for line in error_details:
-                logger.error(line)
+                # Log the detailed error
+                for line in error_details:
+                    logger.error(line)
             
-            # If this is a Telegram-related function (has 'event' in args)
-            # Try to send error message to user
-            try:
-                event = next((arg for arg in args if hasattr(arg, 'respond')), None)
-                if event:
-                    error_msg = (
-                        f"❌ **Error Occurred**\n\n"
-                        f"**Type:** {type(e).__name__}\n"
-                        f"**Message:** {str(e)}\n"
-                        f"**Location:** {error_location}\n"
-                        f"**Function:** {func_name}\n"
-                        f"**Module:** {module_name}"
-                    )
-                    await event.respond(error_msg)
-            except Exception as notify_error:
-                logger.error(f"Failed to notify user of error: {str(notify_error)}")
+            # If this is a Telegram-related function (has 'event' in args),
+            # send the error message to the user without delaying the re-raise
+            event = next((arg for arg in args if hasattr(arg, 'respond')), None)
+            if event:
+                error_msg = (
+                    f"❌ **Error Occurred**\n\n"
+                    f"**Type:** {type(e).__name__}\n"
+                    f"**Message:** {str(e)}\n"
+                    f"**Location:** {error_location}\n"
+                    f"**Function:** {func_name}\n"
+                    f"**Module:** {module_name}"
+                )
+                task = asyncio.create_task(_notify_user(event, error_msg))
+                _notify_tasks.add(task)
+                task.add_done_callback(_notify_tasks.discard)
             
             # Re-raise the original exception
             raise
@@ -1,11 +1,26 @@
+import atexit
 import logging
 import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+from collections import deque
 from datetime import datetime
-from elasticsearch import Elasticsearch
-from typing import Optional
+import orjson
+from typing import TYPE_CHECKING, Optional
 import sys
 
+if TYPE_CHECKING:
+    from elasticsearch import Elasticsearch
+
+# Elasticsearch documents are buffered and sent with the bulk API from a background thread
+ES_BULK_SIZE = int(os.getenv('ES_BULK_SIZE', '500'))
+ES_FLUSH_INTERVAL = float(os.getenv('ES_FLUSH_INTERVAL', '1.0'))  # seconds
+ES_QUEUE_SIZE = 100000  # Oldest documents are dropped beyond this
+
 class CustomLogger:
+    __slots__ = ('logger', 'es', '_es_queue', '_es_wakeup', '_es_flush_lock', '_es_thread', '_es_index', '_listener')
+    
     def __init__(self, name: str):
         self.logger = logging.getLogger(name)
         self.logger.setLevel(logging.DEBUG)
@@ -21,22 +36,20 @@ class CustomLogger:
             '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
         )
         console_handler.setFormatter(console_formatter)
-        self.logger.addHandler(console_handler)
         
         # File handlers
         # Main log file
         main_log_file = os.path.join(logs_dir, 'arkanisbot.log')
-        file_handler = logging.FileHandler(main_log_file)
+        file_handler = WatchedFileHandler(main_log_file, delay=True)
         file_handler.setLevel(logging.DEBUG)
         file_formatter = logging.Formatter(
             '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
         )
         file_handler.setFormatter(file_formatter)
-        self.logger.addHandler(file_handler)
         
         # Error log file
         error_log_file = os.path.join(logs_dir, 'error.log')
-        error_handler = logging.FileHandler(error_log_file)
+        error_handler = WatchedFileHandler(error_log_file, delay=True)
         error_handler.setLevel(logging.ERROR)
         error_formatter = logging.Formatter(
             '%(asctime)s - %(name)s - %(levelname)s - %(message)s\n'
@@ -46,10 +59,24 @@ class CustomLogger:
             '%(exc_info)s\n'
         )
         error_handler.setFormatter(error_formatter)
-        self.logger.addHandler(error_handler)
+        
+        # Callers only enqueue records; a listener thread formats and writes them
+        log_queue = queue.SimpleQueue()
+        self._listener = QueueListener(
+            log_queue, console_handler, file_handler, error_handler,
+            respect_handler_level=True
+        )
+        self._listener.start()
+        atexit.register(self._listener.stop)  # Drains queued records before exit
+        self.logger.addHandler(QueueHandler(log_queue))
         
         # Elasticsearch handler (if configured)
-        self.es: Optional[Elasticsearch] = None
+        self.es: Optional['Elasticsearch'] = None
+        self._es_queue: deque = deque(maxlen=ES_QUEUE_SIZE)
+        self._es_wakeup = threading.Event()
+        self._es_flush_lock = threading.Lock()
+        self._es_thread: Optional[threading.Thread] = None
+        self._es_index = (0, '')  # (year * 12 + month, index name) of the current month
         self.setup_elasticsearch()
         
         # Log startup
@@ -60,6 +87,9 @@ class CustomLogger:
         es_url = os.getenv('ELASTICSEARCH_URL')
         if es_url:
             try:
+                # The client is only imported when Elasticsearch is configured
+                from elasticsearch import Elasticsearch
+                
                 # Suppress Elasticsearch warnings
                 import warnings
                 warnings.filterwarnings("ignore", category=Warning, module="elasticsearch")
@@ -76,6 +106,8 @@ class CustomLogger:
                     self.es = None
                 else:
                     self.logger.info("Successfully connected to Elasticsearch")
+                    self._put_index_template()
+                    self._start_es_worker()
             except Exception as e:
                 self.logger.warning(f"Elasticsearch initialization failed (logging will continue without it): {e}")
                 self.es = None
@@ -84,48 +116,127 @@ class CustomLogger:
             self.logger.debug("No ELASTICSEARCH_URL provided - logging will continue without it")
             self.es = None
     
+    def _put_index_template(self):
+        """Apply write-optimized settings to the monthly log indices"""
+        try:
+            # Logs tolerate losing the last few seconds on a crash, so fsync the translog
+            # and refresh searchers periodically instead of on every request
+            self.es.indices.put_index_template(
+                name='arkanisbot-logs',
+                index_patterns=['arkanisbot-logs-*'],
+                template={
+                    'settings': {
+                        'index.translog.durability': 'async',
+                        'index.translog.sync_interval': '30s',
+                        'index.refresh_interval': '30s',
+                        'number_of_shards': 1,
+                        'number_of_replicas': 0
+                    }
+                }
+            )
+        except Exception as e:
+            self.logger.warning(f"Could not apply Elasticsearch index template: {e}")
+    
+    def _start_es_worker(self):
+        """Start the background thread that ships queued documents to Elasticsearch"""
+        if self._es_thread is None:
+            self._es_thread = threading.Thread(
+                target=self._es_worker, name='es-log-shipper', daemon=True
+            )
+            self._es_thread.start()
+            atexit.register(self.flush)
+    
+    def _es_worker(self):
+        """Flush queued documents once a batch fills up or the flush interval passes"""
+        while True:
+            self._es_wakeup.wait(ES_FLUSH_INTERVAL)
+            self._es_wakeup.clear()
+            self.flush()
+    
+    def flush(self):
+        """Send all queued documents to Elasticsearch"""
+        if not self.es:
+            return
+        
+        with self._es_flush_lock:
+            queue = self._es_queue
+            while queue:
+                batch = [queue.popleft() for _ in range(min(len(queue), ES_BULK_SIZE))]
+                try:
+                    # Build the NDJSON body directly; the client sends bytes as-is
+                    body = b''.join(
+                        orjson.dumps({'index': {'_index': index}}) + b'\n'
+                        + orjson.dumps(doc, default=str) + b'\n'
+                        for index, doc in batch
+                    )
+                    self.es.options(request_timeout=30).bulk(operations=body)
+                except Exception as e:
+                    # Only log Elasticsearch errors at debug level to avoid noise
+                    self.logger.debug(f"Failed to log to Elasticsearch: {e}")
+    
+    def _index_name(self, now: datetime) -> str:
+        """Monthly log index name, rebuilt only when the month changes"""
+        month = now.year * 12 + now.month
+        if self._es_index[0] != month:
+            self._es_index = (month, f'arkanisbot-logs-{now.year:04d}-{now.month:02d}')
+        return self._es_index[1]
+    
     def _log_to_elasticsearch(self, level: str, message: str, **kwargs):
-        """Log message to Elasticsearch if available"""
+        """Queue message for Elasticsearch if available"""
         if not self.es:
             return  # Skip silently if Elasticsearch is not configured
-            
-        try:
-            doc = {
-                'timestamp': datetime.utcnow(),
+        
+        now = datetime.utcnow()
+        self._es_queue.append((
+            self._index_name(now),
+            {
+                'timestamp': now,
                 'level': level,
                 'message': message,
                 'metadata': kwargs,
             }
-            self.es.index(index=f'arkanisbot-logs-{datetime.utcnow().strftime("%Y-%m")}',
-                         document=doc)
-        except Exception as e:
-            # Only log Elasticsearch errors at debug level to avoid noise
-            self.logger.debug(f"Failed to log to Elasticsearch: {e}")
+        ))
+        if len(self._es_queue) >= ES_BULK_SIZE:
+            self._es_wakeup.set()
+    
+    def isEnabledFor(self, level: int) -> bool:
+        """Whether messages at this level would be logged"""
+        return self.logger.isEnabledFor(level)
     
-    def debug(self, message: str, **kwargs):
-        """Log debug level message"""
-        self.logger.debug(message)
-        self._log_to_elasticsearch('DEBUG', message, **kwargs)
+    def debug(self, message: str, *args, **kwargs):
+        """Log debug level message; args are %-formatted only if the level is enabled"""
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        self.logger.debug(message, *args)
+        self._log_to_elasticsearch('DEBUG', message % args if args else message, **kwargs)
     
-    def info(self, message: str, **kwargs):
-        """Log info level message"""
-        self.logger.info(message)
-        self._log_to_elasticsearch('INFO', message, **kwargs)
+    def info(self, message: str, *args, **kwargs):
+        """Log info level message; args are %-formatted only if the level is enabled"""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        self.logger.info(message, *args)
+        self._log_to_elasticsearch('INFO', message % args if args else message, **kwargs)
     
-    def warning(self, message: str, **kwargs):
-        """Log warning level message"""
-        self.logger.warning(message)
-        self._log_to_elasticsearch('WARNING', message, **kwargs)
+    def warning(self, message: str, *args, **kwargs):
+        """Log warning level message; args are %-formatted only if the level is enabled"""
+        if not self.logger.isEnabledFor(logging.WARNING):
+            return
+        self.logger.warning(message, *args)
+        self._log_to_elasticsearch('WARNING', message % args if args else message, **kwargs)
     
-    def error(self, message: str, **kwargs):
-        """Log error level message"""
-        self.logger.error(message)
-        self._log_to_elasticsearch('ERROR', message, **kwargs)
+    def error(self, message: str, *args, **kwargs):
+        """Log error level message; args are %-formatted only if the level is enabled"""
+        if not self.logger.isEnabledFor(logging.ERROR):
+            return
+        self.logger.error(message, *args)
+        self._log_to_elasticsearch('ERROR', message % args if args else message, **kwargs)
     
-    def critical(self, message: str, **kwargs):
-        """Log critical level message"""
-        self.logger.critical(message)
-        self._log_to_elasticsearch('CRITICAL', message, **kwargs)
+    def critical(self, message: str, *args, **kwargs):
+        """Log critical level message; args are %-formatted only if the level is enabled"""
+        if not self.logger.isEnabledFor(logging.CRITICAL):
+            return
+        self.logger.critical(message, *args)
+        self._log_to_elasticsearch('CRITICAL', message % args if args else message, **kwargs)
 
 # Create a default logger instance
 logger = CustomLogger('arkanisbot') 
\ No newline at end of file
@@ -1,40 +1,52 @@
-from redis.asyncio import Redis, ConnectionPool
+import os
+from redis.asyncio import Redis, BlockingConnectionPool
+from redis.asyncio.client import Pipeline
 from typing import Optional
-import json
+import orjson
 from utils.logger import logger
 
+# Set only once the client exists, so hot paths need a single global check
+# (one RedisManager per process)
+_enabled = False
+
 class RedisManager:
+    __slots__ = ('_pool', '_redis')
+    
     def __init__(self):
-        self._pool: Optional[ConnectionPool] = None
+        self._pool: Optional[BlockingConnectionPool] = None
         self._redis: Optional[Redis] = None
-        self._enabled = False
     
     async def init(self, host: str = 'localhost', port: int = 6379, db: int = 0, enabled: bool = True):
         """Initialize Redis connection pool"""
-        self._enabled = enabled
-        if not self._enabled:
+        global _enabled
+        _enabled = False
+        if not enabled:
             logger.info("Redis is disabled, skipping initialization")
             return
         
         try:
-            self._pool = ConnectionPool(
+            # Bounded pool: bursts wait for a free connection instead of opening new ones
+            self._pool = BlockingConnectionPool(
                 host=host,
                 port=port,
                 db=db,
-                decode_responses=True
+                max_connections=int(os.getenv('REDIS_POOL_SIZE', '50')),
+                timeout=5,
+                decode_responses=False  # Values are raw bytes; JSON is decoded by orjson directly
             )
             self._redis = Redis(connection_pool=self._pool)
+            _enabled = True
             
             # Test connection
             await self.health_check()
             logger.info("Redis connection initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize Redis: {str(e)}")
-            self._enabled = False
+            _enabled = False
     
     async def health_check(self) -> bool:
         """Check Redis connection health"""
-        if not self._enabled or not self._redis:
+        if not _enabled:
             return False
         
         try:
@@ -53,19 +65,25 @@ class RedisManager:
     
     @property
     def enabled(self) -> bool:
-        return self._enabled
+        return _enabled
     
     @property
     def client(self) -> Optional[Redis]:
-        return self._redis if self._enabled else None
+        return self._redis if _enabled else None
+    
+    def pipeline(self) -> Optional[Pipeline]:
+        """Non-transactional pipeline for sending several commands in one round trip"""
+        if not _enabled:
+            return None
+        return self._redis.pipeline(transaction=False)
 
     async def set_json(self, key: str, value: dict, ex: Optional[int] = None) -> bool:
         """Store JSON data in Redis with optional expiry"""
-        if not self._enabled or not self._redis:
+        if not _enabled:
             return False
         
         try:
-            await self._redis.set(key, json.dumps(value), ex=ex)
+            await self._redis.set(key, orjson.dumps(value), ex=ex)
             return True
         except Exception as e:
             logger.error(f"Error setting Redis key {key}: {str(e)}")
@@ -73,26 +91,26 @@ class RedisManager:
     
     async def get_json(self, key: str) -> Optional[dict]:
         """Get and parse JSON data from Redis"""
-        if not self._enabled or not self._redis:
+        if not _enabled:
             return None
         
         try:
             data = await self._redis.get(key)
-            return json.loads(data) if data else None
+            return orjson.loads(data) if data else None
         except Exception as e:
             logger.error(f"Error getting Redis key {key}: {str(e)}")
             return None
     
-    async def delete(self, key: str) -> bool:
-        """Delete a key from Redis"""
-        if not self._enabled or not self._redis:
+    async def delete(self, *keys: str) -> bool:
+        """Delete one or more keys from Redis"""
+        if not _enabled:
             return False
         
         try:
-            await self._redis.delete(key)
+            await self._redis.delete(*keys)
             return True
         except Exception as e:
-            logger.error(f"Error deleting Redis key {key}: {str(e)}")
+            logger.error(f"Error deleting Redis keys {', '.join(keys)}: {str(e)}")
             return False
 
 # Global Redis manager instance
@@ -1,18 +1,31 @@
 import os
 import base64
+import functools
+import hashlib
+import hmac
 from typing import Optional
 from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from datetime import datetime, timedelta
-import jwt
 from .logger import logger
 
+# Prefix of AES-GCM tokens; anything else is a legacy Fernet token
+AEAD_PREFIX = 'v2:'
+DECRYPT_CACHE_SIZE = 4096
+
 class SecurityManager:
+    __slots__ = ('secret_key', 'encryption_key', 'fernet', 'aead', '_decrypt_cached')
+    
     def __init__(self):
         self.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')
         self.encryption_key = self._get_or_create_encryption_key()
-        self.fernet = Fernet(self.encryption_key)
+        self.fernet = Fernet(self.encryption_key)  # Only decrypts tokens written before AES-GCM
+        # AES-256-GCM key derived from the Fernet key so existing .env files keep working
+        self.aead = AESGCM(hashlib.sha256(
+            b'arkanisbot-aead-v1' + base64.urlsafe_b64decode(self.encryption_key)
+        ).digest())
+        # Decrypting a token is deterministic (and authenticated), so repeats are served from memory
+        self._decrypt_cached = functools.lru_cache(maxsize=DECRYPT_CACHE_SIZE)(self._decrypt)
     
     def _get_or_create_encryption_key(self) -> bytes:
         """Get or create encryption key from environment"""
@@ -43,15 +56,24 @@ class SecurityManager:
     def encrypt_message(self, message: str) -> str:
         """Encrypt a message"""
         try:
-            return self.fernet.encrypt(message.encode()).decode()
+            nonce = os.urandom(12)
+            token = nonce + self.aead.encrypt(nonce, message.encode(), None)
+            return AEAD_PREFIX + base64.urlsafe_b64encode(token).decode()
         except Exception as e:
             logger.error(f"Encryption failed: {e}")
             raise
     
+    def _decrypt(self, encrypted_message: str) -> str:
+        """Decrypt an AES-GCM or legacy Fernet token, raising if it is invalid"""
+        if encrypted_message.startswith(AEAD_PREFIX):
+            token = base64.urlsafe_b64decode(encrypted_message[len(AEAD_PREFIX):])
+            return self.aead.decrypt(token[:12], token[12:], None).decode()
+        return self.fernet.decrypt(encrypted_message.encode()).decode()
+    
     def decrypt_message(self, encrypted_message: str) -> Optional[str]:
         """Decrypt a message"""
         try:
-            return self.fernet.decrypt(encrypted_message.encode()).decode()
+            return self._decrypt_cached(encrypted_message)
         except Exception as e:
             logger.error(f"Decryption failed: {e}")
             return None
@@ -65,10 +87,12 @@ class SecurityManager:
             expire = datetime.utcnow() + timedelta(minutes=15)
         
         to_encode.update({"exp": expire})
+        import jwt  # Only the admin API issues tokens
         return jwt.encode(to_encode, self.secret_key, algorithm="HS256")
     
     def verify_token(self, token: str) -> Optional[dict]:
         """Verify and decode a JWT token"""
+        import jwt
         try:
             payload = jwt.decode(token, self.secret_key, algorithms=["HS256"])
             return payload
@@ -86,13 +110,9 @@ class SecurityManager:
     def hash_password(self, password: str) -> str:
         """Hash a password using PBKDF2"""
         salt = os.urandom(16)
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
+        key = base64.urlsafe_b64encode(
+            hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000, dklen=32)
         )
-        key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
         return f"{base64.urlsafe_b64encode(salt).decode()}:{key.decode()}"
     
     def verify_password(self, password: str, hashed_password: str) -> bool:
@@ -102,14 +122,8 @@ class SecurityManager:
             salt = base64.urlsafe_b64decode(salt_str.encode())
             stored_key = base64.urlsafe_b64decode(key_str.encode())
             
-            kdf = PBKDF2HMAC(
-                algorithm=hashes.SHA256(),
-                length=32,
-                salt=salt,
-                iterations=100000,
-            )
-            key = kdf.derive(password.encode())
-            return key == stored_key
+            key = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000, dklen=32)
+            return hmac.compare_digest(key, stored_key)
         except Exception as e:
             logger.error(f"Password verification failed: {e}")
             return False
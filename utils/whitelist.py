@@ -1,97 +1,380 @@
-import json
-from typing import Optional, Dict, Tuple
-from datetime import datetime
+import orjson
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, fields, replace
+from typing import Optional, Dict, FrozenSet, List, Set, Tuple
+from datetime import datetime, timezone
 from utils.logger import logger
 from utils.database import db_manager
-from telethon import TelegramClient
+import asyncio
 import os
-from telethon.sessions import StringSession
+import threading
+import time
+import uuid
 from models.whitelist import WhitelistedUser
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import SQLAlchemyError
+from redis.exceptions import ResponseError
 from utils.security import security_manager
 from core.session import session_manager
 
+@dataclass(slots=True)
+class WhitelistEntry:
+    """A whitelisted user's record (slots: no per-entry __dict__)"""
+    api_id: int
+    api_hash: str
+    added_at: Optional[datetime] = None
+    registered: bool = False
+    session_string: Optional[str] = None
+    last_updated: Optional[datetime] = None
+    phone: Optional[str] = None
+    session_id: Optional[str] = None
+    registration_step: Optional[str] = None
+    registration_phone: Optional[str] = None
+    phone_code_hash: Optional[str] = None
+    temp_session: Optional[str] = None
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    metadata: Optional[dict] = field(default_factory=dict)
+    
+    def to_dict(self) -> dict:
+        """Convert entry to a dictionary for JSON and database round-trips"""
+        return {name: getattr(self, name) for name in _ENTRY_FIELDS}
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> 'WhitelistEntry':
+        """Create entry from a dictionary, ignoring unknown keys (e.g. user_id)"""
+        values = {key: value for key, value in data.items() if key in _ENTRY_FIELDS}
+        for name in ('added_at', 'last_updated'):
+            value = values.get(name)
+            if isinstance(value, str):
+                values[name] = datetime.fromisoformat(value)
+        if 'api_id' in values:
+            values['api_id'] = int(values['api_id'])  # Older cache entries stored it as a string
+        return cls(**values)
+
+_ENTRY_FIELDS = frozenset(f.name for f in fields(WhitelistEntry))
+
 class WhitelistManager:
     """Manages whitelisted users and their registration data"""
     
-    REDIS_KEY = 'controlbot:whitelist'  # For caching
+    REDIS_KEY = 'controlbot:whitelist'  # Cache hash: user_id -> JSON user data
     CACHE_DURATION = 3600  # 1 hour cache
+    SNAPSHOT_TTL = 60  # Seconds before the in-process whitelist is re-read (safety net)
+    INVALIDATE_CHANNEL = 'controlbot:whitelist:invalidate'  # Published on every mutation
+    BULK_CHUNK_SIZE = 1000  # Rows per INSERT ... ON CONFLICT statement
+    USER_CACHE_SIZE = 256  # Entries kept in process by get_user_data
+    REGISTRATION_TTL = 600  # Seconds a pending registration keeps its client (codes expire)
+    REAP_INTERVAL = 60  # Seconds between sweeps for expired registrations
+    PERSIST_DEBOUNCE = 0.1  # Seconds the background writer waits to batch queued writes
+    # Whitelist entry keys stored in the database; others (e.g. session_id) live in the cache only
+    _COLUMN_KEYS = frozenset(WhitelistedUser._DICT_FIELDS) | {'metadata'}
+    # HSET field/value pairs (ARGV[2:]) and refresh the TTL (ARGV[1]), only if the hash exists;
+    # runs atomically, so an expiry can never leave a hash holding just these users
+    _HSET_IF_EXISTS = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 2, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
     
     def __init__(self):
-        self.whitelist: Dict[int, dict] = {}
+        # Only ids are kept for every user; entries are loaded on demand into a small LRU
+        self._whitelist_ids: FrozenSet[int] = frozenset()
+        self._user_cache: "OrderedDict[int, WhitelistEntry]" = OrderedDict()
         self.registration_states: Dict[int, dict] = {}
-        self._load_whitelist()
+        self._loaded_at = 0.0
+        # Loads also run in worker threads (initialize); the lock guards the snapshot and LRU.
+        # _generation counts local mutations so a load that raced one is not applied
+        self._state_lock = threading.Lock()
+        self._generation = 0
+        self._instance_id = uuid.uuid4().hex  # Lets us ignore our own invalidations
+        # Writes queued from async code: (user_id, entry, done), drained by _writer_task
+        self._persist_queue: "asyncio.Queue[Tuple[int, WhitelistEntry, asyncio.Future]]" = asyncio.Queue()
+        self._pending_writes: Set[asyncio.Future] = set()  # Futures of writes not yet finished
+        self._writer_task: Optional[asyncio.Task] = None
+        self._reaper_task: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None  # In-flight background reload
+        self._loop: Optional[asyncio.AbstractEventLoop] = None  # Loop invalidations reload on
+        self._subscribed = False
+        self._hset_if_exists = None  # Registered Lua script, created on first cache write
+        # No I/O here: the whitelist loads on first use (_loaded_at 0 is always stale)
+        # or from initialize(), so importing this module never blocks on DB or Redis
         logger.info("WhitelistManager initialized")
     
-    def _serialize_datetime(self, obj):
-        """Helper method to serialize datetime objects"""
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+    async def initialize(self):
+        """Load the whitelist ahead of first use without blocking the event loop"""
+        self._loop = asyncio.get_running_loop()
+        await asyncio.to_thread(self._ensure_fresh)
+    
+    def _subscribe_invalidations(self):
+        """Reload promptly when another process changes the whitelist"""
+        try:
+            pubsub = db_manager.redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.INVALIDATE_CHANNEL: self._on_invalidate})
+            pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+            self._subscribed = True
+        except Exception as e:
+            # Fall back to the SNAPSHOT_TTL refresh alone
+            logger.warning(f"Failed to subscribe to whitelist invalidations: {str(e)}")
+    
+    def _on_invalidate(self, message):
+        """Reload the snapshot in the background when another process changed it"""
+        # Runs on the pub/sub thread; the reload itself is started from the event loop
+        origin, _, user_id = message['data'].partition(':')
+        if origin == self._instance_id:
+            return
+        logger.debug(f"Whitelist changed elsewhere (user {user_id}), reloading")
+        self._loaded_at = 0.0
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._start_refresh)
+    
+    def _publish_invalidation(self, user_id: Optional[int] = None):
+        """Tell other processes the whitelist changed (user_id None: any user)"""
+        try:
+            db_manager.redis.publish(
+                self.INVALIDATE_CHANNEL,
+                f"{self._instance_id}:{'*' if user_id is None else user_id}"
+            )
+        except Exception as e:
+            logger.warning(f"Failed to publish whitelist invalidation: {str(e)}")
     
     def _load_whitelist(self):
-        """Load whitelist from database and cache"""
+        """Load whitelisted user ids from cache or database"""
+        self._loaded_at = time.monotonic()
+        generation = self._generation
+        if not self._subscribed:
+            self._subscribe_invalidations()
         try:
-            # Try to get from cache first
+            # Try to get from cache first; only the field names are needed
             logger.info("Attempting to load whitelist from cache...")
-            cached_data = db_manager.get_cache(self.REDIS_KEY)
-            if cached_data:
-                self.whitelist = json.loads(cached_data)
-                logger.info(f"Loaded {len(self.whitelist)} users from cache")
+            user_ids = self._read_cached_ids()
+            if user_ids:
+                self._apply_snapshot(user_ids, generation)
+                logger.info(f"Loaded {len(user_ids)} users from cache")
                 return
 
-            # If not in cache, load from database
+            # If not in cache, load from database and fill the cache for everyone
             logger.info("Loading whitelist from database...")
-            with db_manager.session_scope() as session:
-                users = session.query(WhitelistedUser).all()
-                self.whitelist = {
-                    str(user.user_id): user.to_dict()
-                    for user in users
-                }
-                
-                # Update cache with datetime serialization
-                db_manager.set_cache(
-                    self.REDIS_KEY,
-                    json.dumps(self.whitelist, default=self._serialize_datetime),
-                    expire=self.CACHE_DURATION
-                )
-                
-                logger.info(f"Loaded {len(self.whitelist)} users from database")
+            users = self._load_all_from_db()
+            self._write_cache(users)
+            self._apply_snapshot(users, generation)
+            
+            logger.info(f"Loaded {len(users)} users from database")
         except Exception as e:
+            # Keep serving the previous snapshot until the next refresh
             logger.error(f"Failed to load whitelist: {str(e)}", exc_info=True)
-            self.whitelist = {}
     
-    def _save_whitelist(self):
-        """Save whitelist to database and update cache"""
+    def _apply_snapshot(self, user_ids, generation: int):
+        """Swap in a loaded id set unless the whitelist was changed here meanwhile"""
+        with self._state_lock:
+            if generation != self._generation:
+                self._loaded_at = 0.0  # Read before our own change landed; load again next access
+                return
+            self._whitelist_ids = frozenset(user_ids)
+            self._user_cache.clear()
+    
+    def _ensure_fresh(self):
+        """Reload the whitelist once the in-process snapshot is older than SNAPSHOT_TTL"""
+        if time.monotonic() - self._loaded_at < self.SNAPSHOT_TTL:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._load_whitelist()  # Worker thread or script: nothing to block
+            return
+        # On the event loop: keep serving the current snapshot while a worker thread reloads it
+        self._start_refresh()
+    
+    def _start_refresh(self):
+        """Reload the snapshot in a worker thread unless a reload is already running"""
+        self._loop = asyncio.get_running_loop()
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(asyncio.to_thread(self._load_whitelist))
+    
+    def _load_all_from_db(self) -> Dict[int, WhitelistEntry]:
+        """Read every whitelisted user from the database"""
+        # Plain column rows: no ORM instances are built for data that goes straight to entries
+        users = {}
+        with db_manager.session_scope() as session:
+            for row in session.execute(select(WhitelistedUser.__table__)).mappings():
+                data = dict(row)
+                data['metadata'] = data.pop('user_metadata') or {}
+                users[data['user_id']] = WhitelistEntry.from_dict(data)
+        return users
+    
+    def _read_cached_ids(self) -> List[int]:
+        """User ids in the cached whitelist hash (empty if not cached)"""
+        try:
+            return [int(key) for key in db_manager.redis.hkeys(self.REDIS_KEY)]
+        except ResponseError:
+            return list(self._read_cache())  # Legacy string key; converts it
+    
+    def _read_cache(self) -> Dict[int, WhitelistEntry]:
+        """Read the cached whitelist hash (empty if not cached)"""
+        try:
+            entries = db_manager.redis.hgetall(self.REDIS_KEY)
+        except ResponseError:
+            # Older releases cached the whole whitelist as one JSON string; convert it
+            legacy = orjson.loads(db_manager.get_cache(self.REDIS_KEY))
+            users = {int(key): WhitelistEntry.from_dict(value) for key, value in legacy.items()}
+            self._write_cache(users)
+            logger.info("Converted cached whitelist to a Redis hash")
+            return users
+        return {int(key): WhitelistEntry.from_dict(orjson.loads(value)) for key, value in entries.items()}
+    
+    def _write_cache(self, users: Dict[int, WhitelistEntry]):
+        """Replace the cached whitelist with the given users"""
+        # orjson encodes the slots dataclass and its datetimes natively, no to_dict() needed
+        with db_manager.redis.pipeline() as pipe:  # MULTI/EXEC: readers never see it half-written
+            pipe.delete(self.REDIS_KEY)
+            if users:
+                pipe.hset(self.REDIS_KEY, mapping={
+                    user_id: orjson.dumps(entry) for user_id, entry in users.items()
+                })
+                pipe.expire(self.REDIS_KEY, self.CACHE_DURATION)
+            pipe.execute()
+    
+    def _cache_users(self, users: Dict[int, WhitelistEntry]):
+        """Write the given users' entries to the cached whitelist"""
+        # The hash must hold every user or nobody: if it expired, the next load refills it
+        if self._hset_if_exists is None:
+            self._hset_if_exists = db_manager.redis.register_script(self._HSET_IF_EXISTS)
+        args = [self.CACHE_DURATION]
+        for user_id, entry in users.items():
+            args += (user_id, orjson.dumps(entry))
+        self._hset_if_exists(keys=[self.REDIS_KEY], args=args)
+    
+    def _remember(self, user_id: int, entry: WhitelistEntry):
+        """Keep an entry in the in-process LRU"""
+        with self._state_lock:
+            self._user_cache[user_id] = entry
+            self._user_cache.move_to_end(user_id)
+            if len(self._user_cache) > self.USER_CACHE_SIZE:
+                self._user_cache.popitem(last=False)
+    
+    def _fetch_user(self, user_id: int) -> Optional[WhitelistEntry]:
+        """Read one user's entry from the cache hash, falling back to the database"""
+        cached = db_manager.redis.hget(self.REDIS_KEY, user_id)
+        if cached:
+            return WhitelistEntry.from_dict(orjson.loads(cached))
+        with db_manager.session_scope() as session:
+            user = session.get(WhitelistedUser, user_id)
+            return WhitelistEntry.from_dict(user.to_dict()) if user else None
+    
+    def _user_row(self, user_id: int, entry: WhitelistEntry) -> dict:
+        """Database fields of a whitelisted user, in WhitelistedUser.from_dict form"""
+        return {
+            **{key: value for key, value in entry.to_dict().items() if key in self._COLUMN_KEYS},
+            'user_id': user_id
+        }
+    
+    def _persist_users(self, users: Dict[int, WhitelistEntry]):
+        """Upsert the given users' rows and refresh their cache entries"""
+        try:
+            # One INSERT ... ON CONFLICT, rather than merge()'s SELECT and per-attribute writes
+            self._bulk_persist(users)
+            self._cache_users(users)
+            self._publish_invalidation(next(iter(users)) if len(users) == 1 else None)
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while saving users {list(users)}: {str(e)}", exc_info=True)
+            raise
+    
+    def _persist_user(self, user_id: int, entry: WhitelistEntry):
+        """Upsert a single user's row and refresh the cache"""
+        self._persist_users({user_id: entry})
+    
+    def _queue_persist(self, user_id: int, entry: WhitelistEntry) -> asyncio.Future:
+        """Persist a user in the background; the returned future resolves once written"""
+        done = asyncio.get_running_loop().create_future()
+        self._pending_writes.add(done)
+        done.add_done_callback(self._pending_writes.discard)
+        self._persist_queue.put_nowait((user_id, entry, done))
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._persist_writer())
+        return done
+    
+    async def _persist_writer(self):
+        """Drain the persist queue in batches, running the blocking writes in a worker thread"""
+        while not self._persist_queue.empty():
+            # Let a burst of registrations collect into one upsert, cache write and publish
+            await asyncio.sleep(self.PERSIST_DEBOUNCE)
+            users: Dict[int, WhitelistEntry] = {}
+            waiters: List[asyncio.Future] = []
+            while not self._persist_queue.empty():
+                user_id, entry, done = self._persist_queue.get_nowait()
+                users[user_id] = entry  # A later write for the same user supersedes earlier ones
+                waiters.append(done)
+            try:
+                await asyncio.to_thread(self._persist_users, users)
+            except asyncio.CancelledError:
+                for done in waiters:
+                    done.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Background save of users {list(users)} failed: {str(e)}")
+                for done in waiters:
+                    if not done.done():
+                        done.set_exception(e)  # Every caller in the batch sees the failure
+            else:
+                for done in waiters:
+                    if not done.done():
+                        done.set_result(None)
+            finally:
+                for _ in waiters:
+                    self._persist_queue.task_done()
+    
+    async def flush(self):
+        """Wait until every queued user write has finished, re-raising the first failure"""
+        await asyncio.gather(*self._pending_writes)
+    
+    def _delete_user(self, user_id: int):
+        """Delete a single user's row and refresh the cache"""
         try:
-            logger.info(f"Saving {len(self.whitelist)} users to database...")
             with db_manager.session_scope() as session:
-                for user_id_str, user_data in self.whitelist.items():
-                    user_id = int(user_id_str)
-                    user = session.query(WhitelistedUser).get(user_id)
-                    
-                    if user is None:
-                        # Create new user
-                        user = WhitelistedUser.from_dict({
-                            'user_id': user_id,
-                            **user_data
-                        })
-                        session.add(user)
+                session.execute(delete(WhitelistedUser).where(WhitelistedUser.user_id == user_id))
+            db_manager.redis.hdel(self.REDIS_KEY, user_id)
+            self._publish_invalidation(user_id)
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while removing user {user_id}: {str(e)}", exc_info=True)
+            raise
+    
+    def _bulk_persist(self, users: Dict[int, WhitelistEntry]):
+        """Upsert many users with INSERT ... ON CONFLICT, one statement per chunk"""
+        # A multi-row VALUES needs the same columns in every row, so group rows by key set
+        groups: Dict[frozenset, List[dict]] = {}
+        for user_id, entry in users.items():
+            row = WhitelistedUser.columns_from_dict(self._user_row(user_id, entry))
+            groups.setdefault(frozenset(row), []).append(row)
+        
+        with db_manager.session_scope() as session:
+            for columns, rows in groups.items():
+                for start in range(0, len(rows), self.BULK_CHUNK_SIZE):
+                    stmt = pg_insert(WhitelistedUser).values(rows[start:start + self.BULK_CHUNK_SIZE])
+                    updates = {name: stmt.excluded[name] for name in columns if name != 'user_id'}
+                    if updates:
+                        stmt = stmt.on_conflict_do_update(index_elements=['user_id'], set_=updates)
                     else:
-                        # Update existing user
-                        for key, value in user_data.items():
-                            setattr(user, key, value)
-                
-                session.commit()
-                
-                # Update cache with datetime serialization
-                db_manager.set_cache(
-                    self.REDIS_KEY,
-                    json.dumps(self.whitelist, default=self._serialize_datetime),
-                    expire=self.CACHE_DURATION
-                )
-                
-                logger.info("Whitelist saved successfully to database and cache")
+                        stmt = stmt.on_conflict_do_nothing(index_elements=['user_id'])
+                    session.execute(stmt)
+    
+    def _save_whitelist(self):
+        """Save the cached whitelist to database and rewrite the cache"""
+        try:
+            users = self.get_all_users()
+            logger.info(f"Saving {len(users)} users to database...")
+            self._bulk_persist(users)
+            self._write_cache(users)
+            self._publish_invalidation()
+            
+            logger.info("Whitelist saved successfully to database and cache")
         except SQLAlchemyError as e:
             logger.error(f"Database error while saving whitelist: {str(e)}", exc_info=True)
             raise
@@ -103,18 +386,23 @@ class WhitelistManager:
         """Add a user to the whitelist"""
         try:
             logger.info(f"Adding user {user_id} to whitelist...")
-            user_data = {
-                'api_id': int(api_id),  # Convert api_id to integer
-                'api_hash': api_hash,
-                'added_at': datetime.utcnow(),
-                'registered': False,
-                'session_string': None,
-                'last_updated': datetime.utcnow()
-            }
+            # The columns are naive UTC DateTime; keep entries comparable with database rows
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            entry = WhitelistEntry(
+                api_id=int(api_id),  # Convert api_id to integer
+                api_hash=api_hash,
+                added_at=now,
+                registered=False,
+                session_string=None,
+                last_updated=now
+            )
             
             # Update memory and persist
-            self.whitelist[str(user_id)] = user_data
-            self._save_whitelist()
+            self._remember(user_id, entry)
+            with self._state_lock:
+                self._whitelist_ids = self._whitelist_ids | {user_id}
+                self._generation += 1
+            self._persist_user(user_id, entry)
             
             logger.info(f"Successfully added user {user_id} to whitelist")
             return True
@@ -125,19 +413,16 @@ class WhitelistManager:
     def remove_user(self, user_id: int) -> bool:
         """Remove a user from the whitelist"""
         try:
-            user_id_str = str(user_id)
-            if user_id_str in self.whitelist:
+            self._ensure_fresh()
+            if user_id in self._whitelist_ids:
                 logger.info(f"Removing user {user_id} from whitelist...")
                 
-                # Remove from database
-                with db_manager.session_scope() as session:
-                    user = session.query(WhitelistedUser).get(user_id)
-                    if user:
-                        session.delete(user)
-                
-                # Remove from memory and update cache
-                del self.whitelist[user_id_str]
-                self._save_whitelist()
+                # Remove from memory, database and cache
+                with self._state_lock:
+                    self._user_cache.pop(user_id, None)
+                    self._whitelist_ids = self._whitelist_ids - {user_id}
+                    self._generation += 1
+                self._delete_user(user_id)
                 
                 logger.info(f"Successfully removed user {user_id} from whitelist")
                 return True
@@ -150,11 +435,79 @@ class WhitelistManager:
     
     def is_whitelisted(self, user_id: int) -> bool:
         """Check if a user is whitelisted"""
-        return str(user_id) in self.whitelist
+        self._ensure_fresh()
+        return user_id in self._whitelist_ids
     
-    def get_user_data(self, user_id: int) -> Optional[dict]:
+    def get_user_data(self, user_id: int) -> Optional[WhitelistEntry]:
         """Get user's registration data"""
-        return self.whitelist.get(str(user_id))
+        self._ensure_fresh()
+        if user_id not in self._whitelist_ids:
+            return None
+        
+        entry = self._user_cache.get(user_id)
+        if entry is None:
+            entry = self._fetch_user(user_id)
+            if entry is None:
+                return None
+        self._remember(user_id, entry)
+        return entry
+    
+    async def aget_user_data(self, user_id: int) -> Optional[WhitelistEntry]:
+        """Get user's registration data; an LRU miss is read in a worker thread"""
+        self._ensure_fresh()
+        if user_id not in self._whitelist_ids:
+            return None
+        
+        entry = self._user_cache.get(user_id)
+        if entry is None:
+            entry = await asyncio.to_thread(self._fetch_user, user_id)
+            if entry is None:
+                return None
+        self._remember(user_id, entry)
+        return entry
+    
+    @asynccontextmanager
+    async def _client_context(self, entry: WhitelistEntry):
+        """Connected registration client for a user; disconnected if the block fails"""
+        # Telethon is only needed for registration; import it on first use
+        from telethon import TelegramClient
+        from telethon.sessions import StringSession
+        
+        client = TelegramClient(
+            StringSession(),
+            api_id=entry.api_id,
+            api_hash=entry.api_hash,
+            device_model="ArkanisUserBot",
+            system_version="1.0",
+            app_version="1.0"
+        )
+        try:
+            await client.connect()
+            yield client
+        except BaseException:  # Includes cancellation by a caller's timeout
+            if client.is_connected():
+                await client.disconnect()
+            raise
+    
+    def _start_reaper(self):
+        """Make sure abandoned registrations get cleaned up"""
+        if self._reaper_task is None or self._reaper_task.done():
+            self._reaper_task = asyncio.create_task(self._reap_registrations())
+    
+    async def _reap_registrations(self):
+        """Disconnect clients of registrations pending longer than REGISTRATION_TTL"""
+        while self.registration_states:
+            await asyncio.sleep(self.REAP_INTERVAL)
+            cutoff = time.monotonic() - self.REGISTRATION_TTL
+            expired = [
+                user_id for user_id, state in self.registration_states.items()
+                if state['started_at'] < cutoff
+            ]
+            for user_id in expired:
+                client = self.registration_states.pop(user_id)['client']
+                if client.is_connected():
+                    await client.disconnect()
+                logger.info(f"Dropped expired registration for user {user_id}")
     
     async def register_user(self, user_id: int, phone: str) -> Tuple[bool, str]:
         """Register a whitelisted user with their phone number"""
@@ -164,42 +517,39 @@ class WhitelistManager:
                 return False, "User is not whitelisted"
             
             # Get user data
-            user_data = self.get_user_data(user_id)
+            user_data = await self.aget_user_data(user_id)
             if not user_data:
                 return False, "User data not found"
             
-            # Create new Telegram client for registration
-            client = TelegramClient(
-                StringSession(),
-                api_id=int(user_data['api_id']),
-                api_hash=user_data['api_hash'],
-                device_model="ArkanisUserBot",
-                system_version="1.0",
-                app_version="1.0"
-            )
-            
-            await client.connect()
-            
-            # Send code request
-            await client.send_code_request(phone)
+            # A new code request reuses the connection from the previous attempt
+            state = self.registration_states.get(user_id)
+            if state and state['client'].is_connected():
+                await state['client'].send_code_request(phone)
+                state.update(phone=phone, attempts=0, started_at=time.monotonic())
+                return True, "Verification code sent"
             
-            # Store registration state
-            self.registration_states[user_id] = {
-                'phone': phone,
-                'client': client,
-                'attempts': 0
-            }
+            async with self._client_context(user_data) as client:
+                # Send code request
+                await client.send_code_request(phone)
+                
+                # Store registration state; the client is owned by it from here on
+                self.registration_states[user_id] = {
+                    'phone': phone,
+                    'client': client,
+                    'attempts': 0,
+                    'started_at': time.monotonic()
+                }
+            self._start_reaper()
             
             return True, "Verification code sent"
             
         except Exception as e:
             logger.error(f"Failed to register user {user_id}: {str(e)}", exc_info=True)
-            if 'client' in locals() and client.is_connected():
-                await client.disconnect()
             return False, str(e)
     
     async def verify_code(self, user_id: int, code: str) -> bool:
         """Verify the registration code and create session"""
+        client = None
         try:
             # Get registration state
             state = self.registration_states.get(user_id)
@@ -220,23 +570,25 @@ class WhitelistManager:
             session_string = client.session.save()
             
             # Get user data for API credentials
-            user_data = self.get_user_data(user_id)
+            user_data = await self.aget_user_data(user_id)
             
             # Generate session ID
             session_id = security_manager.generate_session_id()
             
             # Create session data
+            now = datetime.now(timezone.utc)
+            timestamp = now.isoformat()
             session_data = {
                 'phone': phone,
                 'session': security_manager.encrypt_message(session_string),
-                'created_at': datetime.utcnow().isoformat(),
-                'last_used': datetime.utcnow().isoformat(),
+                'created_at': timestamp,
+                'last_used': timestamp,
                 'user_id': me.id,
                 'username': me.username,
                 'first_name': me.first_name,
                 'last_name': me.last_name,
-                'api_id': user_data['api_id'],
-                'api_hash': user_data['api_hash']
+                'api_id': user_data.api_id,
+                'api_hash': user_data.api_hash
             }
             
             # Save session to file using session manager
@@ -244,29 +596,40 @@ class WhitelistManager:
                 logger.error(f"Failed to save session for user {user_id}")
                 return False
             
-            # Update user data
-            user_data['registered'] = True
-            user_data['phone'] = phone
-            user_data['session_id'] = session_id
-            self._save_whitelist()
+            # Update user data on a copy: the cached entry only changes once the write has landed
+            registered = replace(
+                user_data,
+                registered=True,
+                phone=phone,
+                session_id=session_id,
+                last_updated=now.replace(tzinfo=None)  # Upserts write it as given
+            )
+            # Written by the background writer, off the event loop; a failure raises here
+            await self._queue_persist(user_id, registered)
+            self._remember(user_id, registered)
             
             # Clean up
             await client.disconnect()
-            del self.registration_states[user_id]
+            self.registration_states.pop(user_id, None)
             
             return True
             
         except Exception as e:
             logger.error(f"Failed to verify code for user {user_id}: {str(e)}", exc_info=True)
-            if 'client' in locals() and client.is_connected():
+            if client is not None and client.is_connected():
                 await client.disconnect()
-            if user_id in self.registration_states:
-                del self.registration_states[user_id]
+            self.registration_states.pop(user_id, None)
             return False
     
-    def get_all_users(self) -> Dict[str, dict]:
-        """Get all whitelisted users"""
-        return self.whitelist
+    def get_all_users(self) -> Dict[int, WhitelistEntry]:
+        """Get all whitelisted users
+        
+        Only ids are kept in process, so every call reads the whole cache hash (HGETALL)
+        or, if it is empty, the whole table. Callers that render repeatedly should keep
+        the result for a while, as the admin panel does in MainBotFoundation._get_users.
+        """
+        self._ensure_fresh()
+        return self._read_cache() or self._load_all_from_db()
 
 # Create a global instance
 whitelist_manager = WhitelistManager() 
\ No newline at end of file